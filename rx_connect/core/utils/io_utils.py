@@ -1,3 +1,5 @@
+import fnmatch
+import os
 from pathlib import Path
 from typing import List, Sequence, Tuple, Union
 
@@ -20,9 +22,13 @@ def get_matching_files_in_dir(
     if isinstance(wildcard_patterns, str):
         wildcard_patterns = [wildcard_patterns]
 
+    # List the directory once and match the entry names directly, rather than building a Path
+    # object for every entry as `Path.glob` does
+    file_names = os.listdir(dir_path) if dir_path.is_dir() else []
+
     list_matching_files: List[Path] = []
     for wildcard_pattern in wildcard_patterns:
-        list_matching_files.extend(dir_path.glob(wildcard_pattern))
+        list_matching_files.extend(dir_path / name for name in fnmatch.filter(file_names, wildcard_pattern))
 
     if len(list_matching_files) == 0:
         raise ValueError(
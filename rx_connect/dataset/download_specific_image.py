@@ -10,7 +10,7 @@ from rx_connect import ROOT_DIR
 from rx_connect.core.images.io import download_image
 from rx_connect.core.utils.io_utils import get_matching_files_in_dir
 from rx_connect.core.utils.str_utils import str_to_hash
-from rx_connect.dataset.scrape_nih_images import extract_image_urls
+from rx_connect.dataset.scrape_nih_images import SESSION, extract_image_urls
 from rx_connect.dataset.utils import (
     LAYOUT_METADATA,
     Layouts,
@@ -62,7 +62,14 @@ Example:
     help="""Select the Image layout to download. More information about the layout can be
     obtained at https://data.lhncbc.nlm.nih.gov/public/Pills/RxImageImageLayouts.docx""",
 )
-def main(input_dir: Path, download_dir: Path, layout: str) -> None:
+@click.option(
+    "-w",
+    "--max-workers",
+    default=32,
+    show_default=True,
+    help="Maximum number of threads used to download the images.",
+)
+def main(input_dir: Path, download_dir: Path, layout: str, max_workers: int) -> None:
     # Load the consumer grade images csv file and filter it based on the layout and missing hash
     metadata_df = load_consumer_image_df_by_layout(download_dir, layout=Layouts[layout])
     metadata_df["File_Hash"] = metadata_df.FileName.apply(lambda x: str_to_hash(x))
@@ -99,7 +106,7 @@ def main(input_dir: Path, download_dir: Path, layout: str) -> None:
                 f"https://data.lhncbc.nlm.nih.gov/public/Pills/PillProjectDisc{idx}/images/index.html"
             )
             image_urls += extract_image_urls(project_url)
-        file_name_image_url = {url.rsplit("/")[-1]: url for url in image_urls}
+        file_name_image_url = {url.rsplit("/", 1)[-1]: url for url in image_urls}
         write_pickle(file_name_image_url, image_url_path)
 
     # Get the list of image URLs to download
@@ -128,8 +135,8 @@ def main(input_dir: Path, download_dir: Path, layout: str) -> None:
 
     logger.info(f"Number of images to download: {len(img_info)}")
     # Use a ThreadPoolExecutor to download the images concurrently
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [executor.submit(lambda p: download_image(*p), info) for info in img_info]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download_image, url, path, session=SESSION) for url, path in img_info]
 
         # Display the progress bar while the images are being downloaded
         for _ in tqdm(
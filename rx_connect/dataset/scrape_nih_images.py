@@ -1,23 +1,51 @@
+import asyncio
 import concurrent.futures
 from functools import partial
 from pathlib import Path
-from typing import List, Tuple, Union
-from urllib.parse import urlparse
+from typing import Dict, List, Optional, Tuple, Union
 
+import aiohttp
 import click
 import requests
 from bs4 import BeautifulSoup
-from tqdm import tqdm, trange
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from tqdm.asyncio import tqdm as tqdm_asyncio
 
-from rx_connect.core.images.io import IMAGE_EXTENSIONS, download_image
+from rx_connect.core.images.io import IMAGE_EXTENSIONS
 from rx_connect.dataset.utils import Layouts, load_consumer_image_df_by_layout
 from rx_connect.tools.logging import setup_logger
+from rx_connect.tools.serialization import read_pickle, write_pickle
 
 logger = setup_logger()
 
 CHECK_EXTENSIONS = IMAGE_EXTENSIONS + [".wmv"]
 """Some of the image links are to videos, so we need to check for these extensions as well.
 """
+MAX_CONNECTIONS = 64
+"""Maximum number of simultaneous connections used for downloading the images.
+"""
+MAX_CONNECTIONS_PER_HOST = 16
+"""Maximum number of simultaneous connections to the same host. All the images are hosted on the
+NIH server, so this effectively bounds the download concurrency.
+"""
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+"""Timeouts of each image request. Connecting to the server and each read of the response are bounded
+instead of the whole request, so that a slow but progressing download is not cut off.
+"""
+SESSION = requests.Session()
+"""Session shared by all the HTTP requests to the NIH server so that the TCP connections and TLS
+handshakes are reused across requests.
+"""
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=3))
+
+URLCache = Dict[str, Tuple[str, List[str]]]
+"""Mapping from a project page URL to the page validator (its ETag or Last-Modified header) and the
+image URLs extracted from the page.
+"""
+URL_CACHE_FILE = ".url_cache.pkl"
+"""Name of the file, inside the download directory, where the extracted image URLs are cached.
+"""
 
 """This script downloads all the consumer images from the NIH Pill Image Recognition Challenge
 aviailable at https://data.lhncbc.nlm.nih.gov/public/Pills/index.html.
@@ -50,21 +78,42 @@ of the downloaded images is as follows:
 
 def download_xml(url: str, download_dir: Union[str, Path]) -> None:
     """Download all the XML file from the provided URL."""
-    file_name = Path(urlparse(url).path).name
+    file_name = url.rsplit("/", 1)[-1]
     try:
-        response = requests.get(url)
+        response = SESSION.get(url, timeout=30)
         with (Path(download_dir) / file_name).open("wb") as f:
             f.write(response.content)
     except requests.RequestException as e:
         logger.exception("Error downloading XML file:", e)
 
 
-def extract_image_urls(url: str) -> List[str]:
-    """Extracts all image URLs from the provided URL."""
+def _get_page_validator(url: str) -> Optional[str]:
+    """Returns the ETag, or else the Last-Modified header, of the page without downloading it."""
+    try:
+        headers = SESSION.head(url, timeout=30).headers
+    except requests.RequestException:
+        return None
+
+    return headers.get("ETag") or headers.get("Last-Modified")
+
+
+def extract_image_urls(url: str, url_cache: Optional[URLCache] = None) -> List[str]:
+    """Extracts all image URLs from the provided URL.
+
+    If `url_cache` is provided, the page is only downloaded and parsed when it has changed since it
+    was cached, as reported by its ETag or Last-Modified header. The cache is updated in place.
+    """
+    validator = _get_page_validator(url) if url_cache is not None else None
+    if url_cache is not None and validator is not None and url in url_cache:
+        cached_validator, cached_urls = url_cache[url]
+        if cached_validator == validator:
+            return list(cached_urls)
+
     image_urls: List[str] = []
     try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
+        response = SESSION.get(url, timeout=30)
+        response.raise_for_status()
+        soup = BeautifulSoup(response.content, "lxml")
     except requests.RequestException as e:
         logger.exception("Error accessing the website:", e)
     else:
@@ -76,9 +125,39 @@ def extract_image_urls(url: str) -> List[str]:
                 if not img_url.startswith("http"):
                     image_urls.append(f"{url.rsplit('/', 1)[0]}/{img_url}")
 
+        if url_cache is not None and validator is not None:
+            url_cache[url] = (validator, image_urls)
+
     return image_urls
 
 
+async def _fetch_image(
+    session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, url: str, path: Path
+) -> None:
+    """Download a single image using the shared session and save it to the given path. Errors are
+    logged, so that a failed image does not stop the download of the other images.
+    """
+    try:
+        # Only a bounded number of the images are downloaded at the same time, the others wait here
+        async with semaphore, session.get(url) as response:
+            response.raise_for_status()
+            path.write_bytes(await response.read())
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+        logger.exception(f"Error downloading image from {url}: {e}")
+
+
+async def _download_images(img_info: List[Tuple[str, Path]]) -> None:
+    """Download all the images concurrently over a single pool of connections."""
+    semaphore = asyncio.Semaphore(MAX_CONNECTIONS_PER_HOST)
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST)
+    async with aiohttp.ClientSession(connector=connector, timeout=DOWNLOAD_TIMEOUT) as session:
+        tasks = [_fetch_image(session, semaphore, url, path) for url, path in img_info]
+
+        # Display the progress bar while the images are being downloaded
+        for task in tqdm_asyncio.as_completed(tasks, desc="Downloading images", total=len(tasks)):
+            await task
+
+
 @click.command()
 @click.option("-d", "--download-dir", default="./data/Pill_Images", help="Directory to download images to.")
 @click.option(
@@ -103,7 +182,16 @@ def extract_image_urls(url: str) -> List[str]:
     is_flag=True,
     help="Download the XML files as well.",
 )
-def main(download_dir: str, indices: Tuple[int, int], layout: str, xml_download: bool) -> None:
+@click.option(
+    "-w",
+    "--max-workers",
+    default=32,
+    show_default=True,
+    help="Maximum number of threads used to fetch the XML files and the project pages.",
+)
+def main(
+    download_dir: str, indices: Tuple[int, int], layout: str, xml_download: bool, max_workers: int
+) -> None:
     # Set the start and end indices of the projects to download
     start, end = indices
     assert end >= start, "End index must be greater than or equal to start index."
@@ -116,16 +204,27 @@ def main(download_dir: str, indices: Tuple[int, int], layout: str, xml_download:
     df = load_consumer_image_df_by_layout(download_dir, layout=Layouts[layout])
     filenames = set(df.FileName.unique())
 
-    # ===== Download all the XML files =====
-    if xml_download:
-        # Get all the XML URLs from the project page to download
-        xml_urls = [
-            f"https://data.lhncbc.nlm.nih.gov/public/Pills/ALLXML/PillProjectDisc{idx}.xml"
-            for idx in range(start, end + 1)
-        ]
+    # Create the layout folder if it doesn't exist
+    image_dir = Path(download_dir) / "images" / layout
+    image_dir.mkdir(parents=True, exist_ok=True)
 
-        # Use a ThreadPoolExecutor to download all the XML files concurrently
-        with concurrent.futures.ThreadPoolExecutor() as executor:
+    # Load the image URLs extracted in the previous runs
+    url_cache_path = Path(download_dir) / URL_CACHE_FILE
+    url_cache: URLCache = read_pickle(url_cache_path) if url_cache_path.exists() else {}
+
+    # A single pool of threads is shared by all the projects, so that the threads and the connections
+    # of the session are reused, and the pages of the different projects are fetched concurrently
+    img_info: List[Tuple[str, Path]] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # ===== Download all the XML files =====
+        if xml_download:
+            # Get all the XML URLs from the project page to download
+            xml_urls = [
+                f"https://data.lhncbc.nlm.nih.gov/public/Pills/ALLXML/PillProjectDisc{idx}.xml"
+                for idx in range(start, end + 1)
+            ]
+
+            # Download all the XML files concurrently
             list(
                 tqdm(
                     executor.map(partial(download_xml, download_dir=Path(download_dir) / "AllXML"), xml_urls),
@@ -134,52 +233,34 @@ def main(download_dir: str, indices: Tuple[int, int], layout: str, xml_download:
                 )
             )
 
-    # ===== Download all the pill images =====
-
-    # Loop through all the image pages and download the images
-    for idx in trange(start, end + 1, desc="Project Index"):
-        project_url = f"https://data.lhncbc.nlm.nih.gov/public/Pills/PillProjectDisc{idx}/images/index.html"
-
-        # Extract all the image URLs from the project page
-        image_urls = extract_image_urls(project_url)
-
-        # Create a dictionary of filenames and URLs
-        filenames_url = {Path(urlparse(url).path).name: url for url in image_urls}
-
-        # Get the filenames that belong to the RxImage Layout
-        filenames_layout = set(filenames_url.keys()) & filenames
+        # ===== Collect the pill images to download =====
+        project_urls = [
+            f"https://data.lhncbc.nlm.nih.gov/public/Pills/PillProjectDisc{idx}/images/index.html"
+            for idx in range(start, end + 1)
+        ]
 
-        # Filter the image URLs based on the filenames
-        urls_to_download = [filenames_url[filename] for filename in filenames_layout]
+        # Extract all the image URLs from the project pages concurrently
+        project_image_urls = executor.map(partial(extract_image_urls, url_cache=url_cache), project_urls)
 
-        # Parse project name from one of the image URLs
-        parsed_url = urlparse(urls_to_download[0])
-        folder_name = parsed_url.path.split("/")[-3]
+        # Loop through all the image pages and collect the images to download from all the projects
+        for image_urls in tqdm(project_image_urls, desc="Project Index", total=len(project_urls)):
+            # Create a dictionary of filenames and URLs
+            filenames_url = {url.rsplit("/", 1)[-1]: url for url in image_urls}
 
-        # Create project folder if it doesn't exist
-        image_dir = Path(download_dir) / "images" / layout
-        image_dir.mkdir(parents=True, exist_ok=True)
+            # Get the filenames that belong to the RxImage Layout
+            filenames_layout = filenames_url.keys() & filenames
 
-        # Create a list of tuples containing the image URL and the path to save the image to
-        # Ignore images that have already been downloaded
-        img_info = []
-        for url in urls_to_download:
-            image_name = url.rsplit("/", 1)[-1]
-            if not (image_dir / image_name).exists():
-                img_info.append((url, image_dir / image_name))
+            # Create a list of tuples containing the image URL and the path to save the image to
+            # Ignore images that have already been downloaded
+            for filename in filenames_layout:
+                image_path = image_dir / filename
+                if not image_path.exists():
+                    img_info.append((filenames_url[filename], image_path))
 
-        # Use a ThreadPoolExecutor to download the images concurrently
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(lambda p: download_image(*p), info) for info in img_info]
+    write_pickle(url_cache, url_cache_path)
 
-            # Display the progress bar while the images are being downloaded
-            for _ in tqdm(
-                concurrent.futures.as_completed(futures),
-                desc=f"Downloading {folder_name} images",
-                total=len(futures),
-            ):
-                # results from future are ignored in this case
-                pass
+    # Download the images of all the projects concurrently
+    asyncio.run(_download_images(img_info))
 
 
 if __name__ == "__main__":
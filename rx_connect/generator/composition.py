@@ -1,22 +1,32 @@
 import random
 from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
 
+import cv2
 import numpy as np
 
 from rx_connect.core.utils.func_utils import to_tuple
 from rx_connect.generator.object_overlay import (
     check_overlap,
+    check_overlap_packed,
+    intersects_any_bbox,
     is_pill_within_background,
     overlay_image_onto_background,
+    overlay_mask_packed,
 )
 from rx_connect.generator.sampler import sample_pill_location
-from rx_connect.generator.transform import rescale_pill_and_mask, transform_pill
+from rx_connect.generator.transform import batch_transform_pill, rescale_pill_and_mask
 from rx_connect.tools.logging import setup_logger
 
 logger = setup_logger()
 
 __all__: Sequence[str] = ("random_partition", "generate_image", "ImageComposition")
 
+OVERLAP_MODES: Tuple[str, ...] = ("segmentation", "detection")
+"""The supported modes for tracking the pills in the composition mask. In segmentation mode, each pill
+is labeled with its own index. In detection mode, all pills are labeled as 1, which allows the
+composition mask to be bit-packed while composing.
+"""
+
 
 class ImageComposition(NamedTuple):
     """The image, mask, and label IDs of the composed image."""
@@ -49,20 +59,12 @@ def random_partition(number: int, num_parts: int) -> List[int]:
     """
     assert num_parts <= number, "The number of parts cannot be greater than the number to be divided"
 
-    # subtract num_parts from number to ensure at least 1 for each part
-    number -= num_parts
-
-    parts: List[int] = [0] * num_parts
-    for i in range(num_parts - 1):
-        parts[i] = random.randint(0, number)
-        number -= parts[i]
-    parts[num_parts - 1] = number
-
-    # Add 1 to each part to ensure at least one count per part
-    parts = [part + 1 for part in parts]
+    # Distribute the remaining (number - num_parts) counts uniformly at random among the parts,
+    # and add 1 to each part to ensure at least one count per part
+    counts = np.random.multinomial(number - num_parts, [1.0 / num_parts] * num_parts) + 1
 
     # Sort the parts in descending order.
-    parts = sorted(parts, reverse=True)
+    parts: List[int] = sorted(counts.tolist(), reverse=True)
 
     return parts
 
@@ -120,16 +122,18 @@ def densify_groundtruth(
         ymin = max(0, ymin)
         ymax = min(ymax, multilabel_mask.shape[1])
 
-    while xmin < xmax - 1 and np.max(multilabel_mask[xmin, ymin:ymax]) < target_label:
-        xmin += 1
-    while xmax - 1 > xmin and np.max(multilabel_mask[xmax - 1, ymin:ymax]) < target_label:
-        xmax -= 1
-    while ymin < ymax - 1 and np.max(multilabel_mask[xmin:xmax, ymin]) < target_label:
-        ymin += 1
-    while ymax - 1 > ymin and np.max(multilabel_mask[xmin:xmax, ymax - 1]) < target_label:
-        ymax -= 1
+    # Compute the tight bounding box of the target label within the focus area. OpenCV scans
+    # the binary mask in a single native pass and returns (col, row, width, height).
+    label_mask = multilabel_mask[xmin:xmax, ymin:ymax] >= target_label
+    col, row, width, height = (0, 0, 0, 0)
+    if label_mask.size > 0:
+        col, row, width, height = cv2.boundingRect(label_mask.view(np.uint8))
 
-    return (xmin, xmax, ymin, ymax)
+    # If the target label is absent, collapse to the last row and column of the focus area
+    if height == 0:
+        return (max(xmin, xmax - 1), xmax, max(ymin, ymax - 1), ymax)
+
+    return (xmin + row, xmin + row + height, ymin + col, ymin + col + width)
 
 
 def _compose_pill_on_bg(
@@ -144,6 +148,8 @@ def _compose_pill_on_bg(
     start_index: int = 0,
     enable_defective_pills: bool = False,
     enable_edge_pills: bool = False,
+    placed_bboxes: Optional[Sequence[Tuple[int, int, int, int]]] = None,
+    bit_packed: bool = False,
 ) -> ImageComposition:
     """Compose n_pills pills on a background image.
 
@@ -159,6 +165,10 @@ def _compose_pill_on_bg(
         enable_defective_pills: Whether to allow defective pills to be placed on the background image.
         enable_edge_pills: Whether to allow pills to be placed on the border of the background image.
         start_index: The starting index for the pill labels.
+        placed_bboxes: The bounding boxes of all the pills already present in the composition mask.
+            If provided, the pixel-wise overlap check is skipped for placements whose bounding box
+            does not intersect any existing pill. If None, the overlap is always checked pixel-wise.
+        bit_packed: Whether the composition mask is packed along the columns with 1 bit per pixel.
 
     Returns:
         The composed image, mask, and label IDs.
@@ -172,39 +182,59 @@ def _compose_pill_on_bg(
     pill_image, pill_mask = rescale_pill_and_mask(pill_image, pill_mask, scale=scale)
     h_pill, w_pill = pill_mask.shape
 
-    for _ in range(n_pills):
-        # Transform the pill image and mask.
-        pill_img_t, pill_mask_t = transform_pill(pill_image, pill_mask, allow_defects=enable_defective_pills)
+    # Transform the pill image and mask for each of the pills to compose.
+    transformed_pills = batch_transform_pill(
+        pill_image, pill_mask, n_pills, allow_defects=enable_defective_pills
+    )
+
+    for pill_img_t, pill_mask_t in transformed_pills:
+        # Tight bounding box of the transformed pill, relative to its top left corner. It is reused
+        # across all the placement attempts for this pill.
+        pill_bbox = densify_groundtruth(pill_mask_t)
 
         # Attempt to compose the pill on the background image.
         for _ in range(max_attempts):
             top_left = sample_pill_location(pill_size=(h_pill, w_pill), bg_size=(h_bg, w_bg))
+            x, y = top_left
+            bbox = (y + pill_bbox[0], y + pill_bbox[1], x + pill_bbox[2], x + pill_bbox[3])
 
             # Check if the pill can fit inside the background image.
             if not is_pill_within_background(bg_image, pill_mask_t, top_left, enable_edge_pills):
                 continue
 
-            # Verify that the new pill does not overlap with the existing pills.
-            if not check_overlap(pill_mask_t, comp_mask, top_left, max_overlap):
-                continue
+            # Verify that the new pill does not overlap with the existing pills. The pixel-wise check
+            # is only needed if the pill bounding box intersects the bounding box of an existing pill.
+            may_overlap = placed_bboxes is None or intersects_any_bbox(bbox, [*placed_bboxes, *gt_bbox])
+            if may_overlap:
+                is_valid = (
+                    check_overlap_packed(pill_mask_t, comp_mask, w_bg, top_left, max_overlap)
+                    if bit_packed
+                    else check_overlap(pill_mask_t, comp_mask, top_left, max_overlap)
+                )
+                if not is_valid:
+                    continue
 
             # Add the pill to the background image.
-            bg_image, comp_mask = overlay_image_onto_background(
-                bg_image, comp_mask, pill_img_t, pill_mask_t, top_left, start_index + count
-            )
+            if bit_packed:
+                bg_image, _ = overlay_image_onto_background(
+                    bg_image, None, pill_img_t, pill_mask_t, top_left, start_index + count
+                )
+                comp_mask = overlay_mask_packed(comp_mask, w_bg, pill_mask_t, top_left)
+            else:
+                bg_image, comp_mask = overlay_image_onto_background(
+                    bg_image, comp_mask, pill_img_t, pill_mask_t, top_left, start_index + count
+                )
             label_ids.append(start_index + count)
-            gt_bbox.append(
-                densify_groundtruth(
-                    multilabel_mask=comp_mask,
-                    focus_area=(
-                        top_left[1],
-                        top_left[1] + w_pill,
-                        top_left[0],
-                        top_left[0] + h_pill,
-                    ),
-                    target_label=start_index + count,
+
+            # The new pill is drawn on top of all the existing pills, so its ground truth is the pill
+            # bounding box shifted to the placement location. Only pills cut by the background border
+            # need to be densified again, from the part of the pill mask within the background.
+            if bbox[0] < 0 or bbox[1] > h_bg or bbox[2] < 0 or bbox[3] > w_bg:
+                xmin, xmax, ymin, ymax = densify_groundtruth(
+                    pill_mask_t, focus_area=(-y, h_bg - y, -x, w_bg - x)
                 )
-            )
+                bbox = (y + xmin, y + xmax, x + ymin, x + ymax)
+            gt_bbox.append(bbox)
             count += 1
             break
 
@@ -223,6 +253,8 @@ def generate_image(
     max_attempts: int = 10,
     enable_defective_pills: bool = False,
     enable_edge_pills: bool = False,
+    inplace: bool = False,
+    overlap_mode: str = "segmentation",
 ) -> ImageComposition:
     """Create a composition of pills on a background image.
 
@@ -241,6 +273,11 @@ def generate_image(
         enable_defective_pills: Whether to allow defective pills to be placed on the background image.
         enable_edge_pills: whether to allow the pill object to be on the border of
             the background image.
+        inplace: Whether to compose the pills directly onto `bg_image`. This avoids copying the
+            background, which is worthwhile for large backgrounds that are not reused afterwards.
+        overlap_mode: How the pills are tracked in the composition mask, one of `OVERLAP_MODES`. In
+            detection mode, the composition mask is kept bit-packed while composing, which cuts the
+            memory traffic of the overlap checks 8x. It is only unpacked when returned.
 
     Returns:
         bg_image: The background image with pills.
@@ -249,9 +286,14 @@ def generate_image(
             - It it is segmentation mode, pills will be labeled as it's index, from 1, 2, 3..., n_pills.
         pill_labels: List of labels of the pills.
     """
+    if overlap_mode not in OVERLAP_MODES:
+        raise ValueError(f"`overlap_mode` should be one of {OVERLAP_MODES}, but provided {overlap_mode}.")
+    bit_packed = overlap_mode == "detection"
 
-    bg_image = bg_image.copy()
-    comp_mask = np.zeros(bg_image.shape[:2], dtype=np.uint8)
+    if not inplace:
+        bg_image = bg_image.copy()
+    h_bg, w_bg = bg_image.shape[:2]
+    comp_mask = np.zeros((h_bg, (w_bg + 7) // 8 if bit_packed else w_bg), dtype=np.uint8)
 
     # Randomly sample the number of pills to compose.
     num_pills = np.random.randint(min_pills, max_pills + 1)
@@ -283,8 +325,13 @@ def generate_image(
             enable_defective_pills=enable_defective_pills,
             enable_edge_pills=enable_edge_pills,
             start_index=len(label_ids),
+            placed_bboxes=gt_bbox,
+            bit_packed=bit_packed,
         )
         label_ids += labels
         gt_bbox += bboxes
 
+    if bit_packed:
+        comp_mask = np.unpackbits(comp_mask, axis=1, count=w_bg)
+
     return ImageComposition(bg_image, comp_mask, label_ids, gt_bbox, pills_per_type)
@@ -1,13 +1,28 @@
 import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+from types import TracebackType
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 
 import albumentations as A
 import numpy as np
 import pandas as pd
-from skimage.io import imread
 
 from rx_connect import CACHE_DIR
+from rx_connect.core.images.io import read_grayscale_image, read_rgb_image
 from rx_connect.core.types.generator import SEGMENTATION_LABELS, PillMask, PillMaskPaths
 from rx_connect.core.utils.io_utils import get_matching_files_in_dir
 from rx_connect.generator.metadata_filter import parse_file_hash
@@ -120,6 +135,9 @@ def enrich_metadata_with_paths(
 def load_pill_mask_paths(data_dir: Union[str, Path]) -> Dict[str, PillMaskPaths]:
     """Load all the pill images and the corresponding masks path.
 
+    New masks are saved as PNG format as it can handle binary data without loss of information.
+    However, old masks are saved as JPG format. Hence, we need to check for both formats.
+
     Args:
         data_dir: The directory containing all the pill images and the corresponding
             masks. The directory should have two subdirectories: "images" and "masks".
@@ -134,11 +152,11 @@ def load_pill_mask_paths(data_dir: Union[str, Path]) -> Dict[str, PillMaskPaths]
         imgs_path = fetch_file_paths_from_remote_dir(data_dir / "images")
         masks_path = fetch_file_paths_from_remote_dir(data_dir / "masks")
     else:
-        imgs_path = get_matching_files_in_dir(data_dir / "images", "*.jpg")
-        masks_path = get_matching_files_in_dir(data_dir / "masks", "*.[jp][pn]g")
-        """New masks are saved as PNG format as it can handle binary data without loss of information.
-        However, old masks are saved as JPG format. Hence, we need to check for both formats.
-        """
+        # Scan the images and masks directories concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            imgs_future = executor.submit(get_matching_files_in_dir, data_dir / "images", "*.jpg")
+            masks_future = executor.submit(get_matching_files_in_dir, data_dir / "masks", "*.[jp][pn]g")
+        imgs_path, masks_path = imgs_future.result(), masks_future.result()
 
     # Sort the file paths to ensure that the images and masks are aligned
     imgs_path, masks_path = sorted(imgs_path), sorted(masks_path)
@@ -187,37 +205,45 @@ def load_comp_mask_paths(data_dir: Union[str, Path]) -> List[Path]:
     return masks_path
 
 
+@lru_cache(maxsize=256)
 def load_image_and_mask(
     image_path: Union[str, Path], mask_path: Union[str, Path], thresh: int = 25
 ) -> PillMask:
     """Get the image and boolean mask from the pill mask paths.
 
+    The decoded image and mask are cached, so pills that are sampled repeatedly are only read from
+    disk once. The returned arrays are shared between calls and are therefore marked as read-only.
+
     Args:
         image: The path to the pill image. Can be a local path or a remote path.
         mask: The path to the pill mask. Can be a local path or a remote path.
         thresh: The threshold at which to binarize the mask. Useful only for the old ePillID masks.
 
     Returns:
-        img: The pill image as a numpy array.
-        mask: The pill mask as a boolean array.
+        img: The pill image as a read-only numpy array.
+        mask: The pill mask as a read-only boolean array.
     """
     # Fetch the image and mask from remote server, if necessary
     image_path = fetch_from_remote(image_path, cache_dir=CACHE_DIR / "images", skip_check=True)
     mask_path = fetch_from_remote(mask_path, cache_dir=CACHE_DIR / "masks", skip_check=True)
 
     # Load the pill image
-    image = imread(image_path)
+    image = read_rgb_image(image_path)
 
     # Load the pill mask
-    mask = imread(mask_path, as_gray=True)
+    mask = read_grayscale_image(mask_path)
 
     # Binarize the mask if it is not binary already
     # The new masks contain only 0s and 1s, but the old masks can be anything between 0 and 255
     if len(np.unique(mask)) > 2:
-        mask[mask <= thresh] = 0
-        mask[mask > thresh] = 1
+        mask = mask > thresh
+    mask = mask.astype(bool, copy=False)
+
+    # Guard the cached arrays against accidental in-place modification
+    image.setflags(write=False)
+    mask.setflags(write=False)
 
-    return PillMask(image=image, mask=mask.astype(bool))
+    return PillMask(image=image, mask=mask)
 
 
 def load_pills_and_masks(
@@ -249,7 +275,7 @@ def load_pills_and_masks(
 
 
 def load_random_pills_and_masks(
-    image_mask_paths: Sequence[PillMaskPaths], *, pill_types: int = 1, thresh: int = 25
+    image_mask_paths: Sequence[PillMaskPaths], *, pill_types: int = 1, thresh: int = 25, max_workers: int = 8
 ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
     """Load `pill_types` random pills and masks from the given paths.
 
@@ -257,24 +283,90 @@ def load_random_pills_and_masks(
         image_mask_paths: The paths to the pill images and masks.
         pill_types: The number of pills to sample.
         thresh: The threshold at which to binarize the mask.
+        max_workers: The maximum number of threads used to load the pills.
 
     Returns:
         Tuple of lists of all pill images and masks.
     """
-    pill_images: List[np.ndarray] = []
-    pill_masks: List[np.ndarray] = []
+    # Randomly sample `pill_types` pills, and load them concurrently
+    indices = np.random.randint(len(image_mask_paths), size=pill_types)
+    image_paths = [image_mask_paths[idx].image_path for idx in indices]
+    mask_paths = [image_mask_paths[idx].mask_path for idx in indices]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pills = list(executor.map(partial(load_image_and_mask, thresh=thresh), image_paths, mask_paths))
 
-    # Randomly sample `pill_types` pills
-    for _ in range(pill_types):
-        # Randomly sample a pill image and mask
-        idx = np.random.randint(len(image_mask_paths))
-        image_path, mask_path = image_mask_paths[idx]
+    return [pill.image for pill in pills], [pill.mask for pill in pills]
 
-        pill_img, pill_mask = load_image_and_mask(image_path, mask_path, thresh=thresh)
-        pill_images.append(pill_img)
-        pill_masks.append(pill_mask)
 
-    return pill_images, pill_masks
+class PillPrefetcher:
+    """Loads the pills of the upcoming samples in background threads.
+
+    Each sample is a sequence of pill image and mask paths drawn by `sampler`. A queue of `depth`
+    samples is kept in flight on a thread pool, with the pills of each sample loaded concurrently, so
+    that the disk reads and image decoding overlap with the work done on the previous samples, e.g.
+    composing an image. Each consumed sample is immediately replaced by a new one.
+
+    The prefetcher should be closed once it is no longer needed, either by calling `close` or by
+    using it as a context manager.
+    """
+
+    def __init__(
+        self,
+        sampler: Callable[[], Sequence[PillMaskPaths]],
+        *,
+        thresh: int = 25,
+        depth: int = 2,
+        max_workers: int = 8,
+    ) -> None:
+        if depth < 1:
+            raise ValueError(f"`depth` should be a positive integer, but provided {depth}.")
+
+        self._sampler = sampler
+        self._thresh = thresh
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._queue: Deque[Tuple[Sequence[PillMaskPaths], List[Future[PillMask]]]] = deque(
+            self._submit() for _ in range(depth)
+        )
+
+    def _submit(self) -> Tuple[Sequence[PillMaskPaths], List[Future[PillMask]]]:
+        """Draw a new sample and submit the loading of its pill images and masks to the thread pool."""
+        pill_mask_paths = self._sampler()
+        futures = [
+            self._pool.submit(load_image_and_mask, image_path, mask_path, thresh=self._thresh)
+            for image_path, mask_path in pill_mask_paths
+        ]
+        return pill_mask_paths, futures
+
+    def next(self) -> Tuple[List[PillMaskPaths], List[np.ndarray], List[np.ndarray]]:
+        """Return the oldest prefetched sample and queue up a new one in its place.
+
+        Returns:
+            Tuple of the sampled paths, and the lists of the corresponding pill images and masks.
+        """
+        pill_mask_paths, futures = self._queue.popleft()
+        self._queue.append(self._submit())
+
+        pills = [future.result() for future in futures]
+        return list(pill_mask_paths), [pill.image for pill in pills], [pill.mask for pill in pills]
+
+    def close(self) -> None:
+        """Cancel the pending loads and shut down the thread pool."""
+        for _, futures in self._queue:
+            for future in futures:
+                future.cancel()
+        self._queue.clear()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "PillPrefetcher":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
 
 
 def load_bg_image(path: Path, min_dim: int = 1024, max_dim: int = 1920) -> np.ndarray:
@@ -289,7 +381,7 @@ def load_bg_image(path: Path, min_dim: int = 1024, max_dim: int = 1920) -> np.nd
         bg_img: The background image as a numpy array.
     """
     # Load the background image
-    bg_img = imread(path)
+    bg_img = read_rgb_image(path)
 
     # Resize the background image
     bg_img = resize_bg(bg_img, max_dim, min_dim)
@@ -308,13 +400,13 @@ def generate_random_bg(height: int, width: int) -> np.ndarray:
         np.ndarray: random background image.
     """
     # Generate a random color for the background
-    background_color = np.random.randint(150, 256, size=(3,)).tolist()
+    background_color = np.random.randint(150, 256, size=(3,), dtype=np.uint8)
 
-    # Create a black background image
-    background_image = np.zeros((height, width, 3), np.uint8)
+    # Create an uninitialized background image
+    background_image = np.empty((height, width, 3), np.uint8)
 
-    # Fill the background image with the random color
-    background_image[:] = background_color
+    # Fill the background image with the random color, broadcasted along the last axis
+    background_image[...] = background_color
 
     return background_image
 
@@ -1,7 +1,11 @@
-from typing import Tuple
+from typing import Optional, Sequence, Tuple
 
 import numpy as np
 
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+"""Number of set bits in each of the 256 possible byte values.
+"""
+
 
 def is_pill_within_background(
     bg_image: np.ndarray,
@@ -59,17 +63,17 @@ def is_pill_within_background(
 
 def overlay_image_onto_background(
     bg_image: np.ndarray,
-    bg_mask: np.ndarray,
+    bg_mask: Optional[np.ndarray],
     pill_img: np.ndarray,
     pill_mask: np.ndarray,
     top_left_corner: Tuple[int, int],
     pill_id: int,
-) -> Tuple[np.ndarray, np.ndarray]:
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
     """Overlay the given image onto the background image using the specified mask.
 
     Args:
         bg_image (np.ndarray): The original background image.
-        bg_mask (np.ndarray): Mask for the background image.
+        bg_mask (Optional[np.ndarray]): Mask for the background image. If None, only the image is updated.
         pill_img (np.ndarray): Image to overlay on the background.
         pill_mask (np.ndarray): Binary mask for the image to overlay.
         top_left_corner (Tuple[int, int]): Coordinates for the top left corner of the overlay.
@@ -110,6 +114,9 @@ def overlay_image_onto_background(
         resized_bg_img * (~effective_rgb_mask) + resized_pill_img * effective_rgb_mask
     )
 
+    if bg_mask is None:
+        return bg_image, bg_mask
+
     # Update the mask to reflect the overlay, again only altering masked locations
     bg_mask[bg_top_y : bg_top_y + eff_height, bg_top_x : bg_top_x + eff_width] = (
         bg_mask[bg_top_y : bg_top_y + eff_height, bg_top_x : bg_top_x + eff_width] * (~effective_mask)
@@ -155,3 +162,116 @@ def check_overlap(
     # If the sum of the overlapped area divided by the total area of the pill is less than
     # the allowed overlap fraction, return True; else False.
     return overlap_patch.sum() / mask.sum() <= overlap_fraction + 1e-6
+
+
+def _pack_mask_onto_grid(
+    mask: np.ndarray, comp_size: Tuple[int, int], top_left: Tuple[int, int]
+) -> Tuple[np.ndarray, int, int]:
+    """Bit-pack the part of a pill mask that lies within the composition, aligned to its byte grid.
+
+    Args:
+        mask (np.ndarray): Binary mask of the pill.
+        comp_size (Tuple[int, int]): The (height, width) of the unpacked composition mask.
+        top_left (Tuple[int, int]): Coordinates (x, y) of the top-left corner of the pill.
+
+    Returns:
+        np.ndarray: The packed pill mask, with its rows aligned to the bytes of the packed composition.
+        int: The first row of the composition covered by the packed pill mask.
+        int: The first byte column of the packed composition covered by the packed pill mask.
+    """
+    x, y = top_left
+    h_mask, w_mask = mask.shape
+    h_comp, w_comp = comp_size
+
+    # Clip the pill mask to the bounds of the composition
+    row_start, col_start = max(0, y), max(0, x)
+    row_end, col_end = max(row_start, min(h_comp, y + h_mask)), max(col_start, min(w_comp, x + w_mask))
+    patch = mask[row_start - y : row_end - y, col_start - x : col_end - x].astype(bool, copy=False)
+
+    # Shift the patch to the right so that its bits line up with the bytes of the packed composition
+    bit_offset = col_start % 8
+    patch = np.pad(patch, ((0, 0), (bit_offset, 0)))
+
+    return np.packbits(patch, axis=1), row_start, col_start // 8
+
+
+def check_overlap_packed(
+    mask: np.ndarray,
+    comp_bits: np.ndarray,
+    comp_width: int,
+    top_left: Tuple[int, int],
+    overlap_fraction: float = 0.2,
+) -> bool:
+    """Bit-packed variant of `check_overlap`.
+
+    The composition mask is stored with 1 bit per pixel (see `np.packbits`), so the overlap check
+    reads 8x less memory than with the `uint8` composition mask. Only usable when the pill identity
+    is not needed in the composition mask, i.e. for detection.
+
+    Args:
+        mask (np.ndarray): Binary mask of the pill to be added to the composition.
+        comp_bits (np.ndarray): Composition mask packed along the columns.
+        comp_width (int): The width of the unpacked composition mask.
+        top_left (Tuple[int, int]): Coordinates (x, y) of the top-left corner where the
+            pill should be positioned in the composition.
+        overlap_fraction (float, optional): Threshold for the maximum allowed fraction of the pill
+            that may overlap with pre-existing elements. Defaults to 0.2.
+
+    Returns:
+        bool: False if the overlap fraction exceeds the specified 'overlap_fraction', True otherwise.
+    """
+    packed, row, col = _pack_mask_onto_grid(mask, (comp_bits.shape[0], comp_width), top_left)
+    h_packed, w_packed = packed.shape
+
+    # Count the pixels set in both the pill mask and the composition mask
+    comp_patch = comp_bits[row : row + h_packed, col : col + w_packed]
+    overlap = _POPCOUNT_TABLE[packed & comp_patch].sum(dtype=np.int64)
+
+    return overlap / mask.sum() <= overlap_fraction + 1e-6
+
+
+def overlay_mask_packed(
+    comp_bits: np.ndarray, comp_width: int, mask: np.ndarray, top_left: Tuple[int, int]
+) -> np.ndarray:
+    """Add a pill mask to a bit-packed composition mask in place.
+
+    Args:
+        comp_bits (np.ndarray): Composition mask packed along the columns.
+        comp_width (int): The width of the unpacked composition mask.
+        mask (np.ndarray): Binary mask of the pill.
+        top_left (Tuple[int, int]): Coordinates (x, y) of the top-left corner of the pill.
+
+    Returns:
+        np.ndarray: The updated packed composition mask.
+    """
+    packed, row, col = _pack_mask_onto_grid(mask, (comp_bits.shape[0], comp_width), top_left)
+    h_packed, w_packed = packed.shape
+    comp_bits[row : row + h_packed, col : col + w_packed] |= packed
+
+    return comp_bits
+
+
+def intersects_any_bbox(bbox: Tuple[int, int, int, int], bboxes: Sequence[Tuple[int, int, int, int]]) -> bool:
+    """Check if a bounding box intersects any of the given bounding boxes.
+
+    This is a cheap test to rule out any overlap between pills before comparing their masks
+    pixel by pixel in `check_overlap`.
+
+    Args:
+        bbox (Tuple[int, int, int, int]): The bounding box to test, in the format
+            (xmin, xmax, ymin, ymax) with exclusive max.
+        bboxes (Sequence[Tuple[int, int, int, int]]): The bounding boxes to test against, in the
+            same format.
+
+    Returns:
+        bool: True if the bounding box intersects at least one of the given bounding boxes.
+    """
+    if len(bboxes) == 0:
+        return False
+
+    xmin, xmax, ymin, ymax = bbox
+    boxes = np.asarray(bboxes)
+
+    return bool(
+        np.any((boxes[:, 0] < xmax) & (xmin < boxes[:, 1]) & (boxes[:, 2] < ymax) & (ymin < boxes[:, 3]))
+    )
@@ -1,5 +1,5 @@
 import random
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 import albumentations as A
 import cv2
@@ -130,38 +130,68 @@ def transform_pill(
     Returns:
         transformed pill image and mask.
     """
+    return batch_transform_pill(image, mask, 1, allow_defects=allow_defects, augmentations=augmentations)[0]
+
+
+def batch_transform_pill(
+    image: np.ndarray,
+    mask: np.ndarray,
+    n: int,
+    allow_defects: bool = False,
+    augmentations: Optional[A.BasicTransform] = None,
+) -> List[PillMask]:
+    """Generate `n` independently transformed copies of the same pill. This is equivalent to
+    calling `transform_pill` `n` times, but the pill is converted to uint8 and the augmentation
+    pipelines are built only once for the whole batch.
+
+    Args:
+        image: pill image as a numpy array.
+        mask: binary mask of the pill image.
+        n: number of transformed copies to generate.
+        allow_defects: whether to allow defects in the pill image.
+        augmentations: color and/or noise augmentations to apply to the pill image.
+
+    Returns:
+        list of transformed pill images and masks.
+    """
     # Convert the image and the boolean mask to uint8.
     image = (
         (image * 255).astype(np.uint8) if image.dtype in (np.float32, np.float64) else image.astype(np.uint8)
     )
     mask = mask.astype(np.uint8)
+    height, width = mask.shape
 
     # Initialize the transforms to resize the image and mask.
-    geometric_aug = A.Compose([A.Rotate(limit=180, border_mode=0, mask_value=0, p=1.0)])
+    rotate_aug = A.Compose([A.Rotate(limit=180, border_mode=0, mask_value=0, p=1.0)])
     color_aug = augmentations or A.Compose(
         [A.RandomBrightnessContrast(brightness_limit=0.02, contrast_limit=0.02, brightness_by_max=True)]
     )
 
-    # Add random crop to the augmentations if defects are allowed.
-    if allow_defects:
-        height, width = mask.shape
-        # Randomly select the fraction of the image to crop. The fraction is selected
-        # from the range [80, 100) percent.
-        fraction = 0.01 * np.random.randint(80, 100)
+    pills: List[PillMask] = []
+    for _ in range(n):
+        geometric_aug = rotate_aug
 
-        # Apply random crop augmentation 25% of the time
-        geometric_aug = A.Compose(
-            [
-                geometric_aug,
-                A.RandomCrop(p=0.25, height=int(fraction * height), width=int(fraction * width)),
-            ]
-        )
+        # Add random crop to the augmentations if defects are allowed.
+        if allow_defects:
+            # Randomly select the fraction of the image to crop. The fraction is selected
+            # from the range [80, 100) percent.
+            fraction = 0.01 * np.random.randint(80, 100)
 
-    # First, apply the geometric augmentation to the image and mask.
-    transforms_rot = geometric_aug(image=image, mask=mask)
-    image_t, mask_t = transforms_rot["image"], transforms_rot["mask"]
+            # Apply random crop augmentation 25% of the time
+            geometric_aug = A.Compose(
+                [
+                    rotate_aug,
+                    A.RandomCrop(p=0.25, height=int(fraction * height), width=int(fraction * width)),
+                ]
+            )
 
-    # Second, apply the color augmentation to the image.
-    image_t = color_aug(image=image_t)["image"]
+        # First, apply the geometric augmentation to the image and mask.
+        transforms_rot = geometric_aug(image=image, mask=mask)
+        image_t, mask_t = transforms_rot["image"], transforms_rot["mask"]
 
-    return PillMask(image_t, mask_t)
+        # Second, apply the color augmentation to the image.
+        image_t = color_aug(image=image_t)["image"]
+
+        pills.append(PillMask(image_t, mask_t))
+
+    return pills
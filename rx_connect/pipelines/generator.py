@@ -1,17 +1,20 @@
+import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Sequence, Tuple, Union
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import albumentations as A
 import numpy as np
 
 from rx_connect import SHARED_RXIMAGEV2_DATA_DIR
+from rx_connect.core.types.generator import PillMaskPaths
 from rx_connect.generator.composition import (
     ImageComposition,
     densify_groundtruth,
     generate_image,
 )
 from rx_connect.generator.io_utils import (
+    PillPrefetcher,
     enrich_metadata_with_paths,
     get_background_image,
     load_metadata,
@@ -110,6 +113,12 @@ class RxImageGenerator:
     enable_edge_pills: bool = False
     """Whether to allow pills to be placed at the edge of the image.
     """
+    prefetch_depth: int = 0
+    """Number of upcoming pill samples whose images and masks are loaded in background threads while
+    the current image is composed. Useful when many images are generated in a loop by the same
+    generator. The samples are drawn ahead of time, so changes to the sampling attributes only apply
+    after the prefetched samples are consumed. If 0, the pills are loaded when they are sampled.
+    """
 
     def __post_init__(self) -> None:
         # Validate the arguments
@@ -128,6 +137,10 @@ class RxImageGenerator:
             self._metadata_df, colors=self.colors, shapes=self.shapes
         )
 
+        # The pill prefetcher is created on the first use, in the process that uses it
+        self._pill_prefetcher: Optional[PillPrefetcher] = None
+        self._prefetcher_pid: Optional[int] = None
+
         # Set the background image
         self.config_background(self.bg_dir, self.image_size)
 
@@ -160,6 +173,11 @@ class RxImageGenerator:
                 f"`max_attempts` should be a positive integer, but provided {self.max_attempts}."
             )
 
+        if self.prefetch_depth < 0:
+            raise ValueError(
+                f"`prefetch_depth` should be a non-negative integer, but provided {self.prefetch_depth}."
+            )
+
     @property
     def sampled_images_path(self) -> List[Path]:
         """Return the sampled pill images paths."""
@@ -209,14 +227,44 @@ class RxImageGenerator:
         image_size = image_size or self.image_size
         self._bg_image = get_background_image(path, *image_size, apply_augmentations=self.apply_bg_aug)
 
-    def config_pills(self) -> None:
-        """Configure the pill images and masks."""
-        self._sampled_pill_mask_paths = sample_from_color_shape_by_ndc(
+    def _sample_pill_mask_paths(self) -> List[PillMaskPaths]:
+        """Sample the paths of the pill images and masks to compose."""
+        return sample_from_color_shape_by_ndc(
             self._filtered_metadata_df, pill_types=self.num_pills_type, sampling=self.sampling_type
         )
-        self._pill_images, self._pill_masks = load_pills_and_masks(
-            self._sampled_pill_mask_paths, thresh=self.thresh
-        )
+
+    def _get_pill_prefetcher(self) -> PillPrefetcher:
+        """Return the pill prefetcher of the current process. It is created again in forked processes, whose
+        copy of the thread pool has no running threads.
+        """
+        if self._pill_prefetcher is None or self._prefetcher_pid != os.getpid():
+            self._pill_prefetcher = PillPrefetcher(
+                self._sample_pill_mask_paths, thresh=self.thresh, depth=self.prefetch_depth
+            )
+            self._prefetcher_pid = os.getpid()
+        return self._pill_prefetcher
+
+    def config_pills(self) -> None:
+        """Configure the pill images and masks."""
+        if self.prefetch_depth > 0:
+            (
+                self._sampled_pill_mask_paths,
+                self._pill_images,
+                self._pill_masks,
+            ) = self._get_pill_prefetcher().next()
+        else:
+            self._sampled_pill_mask_paths = self._sample_pill_mask_paths()
+            self._pill_images, self._pill_masks = load_pills_and_masks(
+                self._sampled_pill_mask_paths, thresh=self.thresh
+            )
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Return the state of the object for pickling. The pill prefetcher and its thread pool cannot
+        be pickled, and are created again when needed.
+        """
+        state = self.__dict__.copy()
+        state["_pill_prefetcher"] = None
+        return state
 
     def __call__(self, new_bg: bool = True, new_pill: bool = True) -> ImageComposition:
         """Generate synthetic images along with the masks and labels.
@@ -1,18 +1,32 @@
+import os
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Callable, ClassVar, Dict, List, Optional, Union, cast, overload
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Union,
+    cast,
+    overload,
+)
 
 import albumentations as A
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 from albumentations.pytorch.transforms import ToTensorV2
-from sklearn.metrics.pairwise import cosine_similarity, euclidean_distances
+from sklearn.metrics.pairwise import cosine_similarity
 from vlad import VLAD
 
 from rx_connect import CACHE_DIR, SHARED_REMOTE_CKPT_DIR
 from rx_connect.core.utils.cv_utils import equalize_histogram
-from rx_connect.generator.continuous_learning_dataloader import UNIFIED_TRANSFORM
 from rx_connect.tools.data_tools import fetch_from_remote
 from rx_connect.tools.device import get_best_available_device
 from rx_connect.tools.logging import setup_logger
@@ -24,14 +38,37 @@ from rx_connect.verification.embedding.lightning_model import EmbeddingLightning
 
 logger = setup_logger()
 
+ML_INPUT_SIZE: int = 224
+"""Height and width of the square input images of the embedding models."""
+
+IMAGENET_MEAN: List[float] = [0.485, 0.456, 0.406]
+"""Per-channel mean of the ImageNet dataset, used to normalize the input images."""
+
+IMAGENET_STD: List[float] = [0.229, 0.224, 0.225]
+"""Per-channel standard deviation of the ImageNet dataset, used to normalize the input images."""
+
+ENCODE_BATCH_SIZE: int = 64
+"""Maximum number of images encoded together in a single forward pass of the model."""
+
 
 def custom_similarity_fn_L2(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
     """
     Calculates L2 norm in range [0,1].
     Original output range of Euclidean distances is [2, 0] (lower means more similar).
     """
-    d = euclidean_distances(v1, v2)
-    return 1 - d / 2
+    v1, v2 = np.atleast_2d(v1), np.atleast_2d(v2)
+    dtype = np.result_type(v1, v2, np.float32)
+
+    # Expand ||x - y||^2 = ||x||^2 + ||y||^2 - 2 x.y, so that all the distances come from a single
+    # matrix product. The expansion loses precision for close vectors, so it is computed in float64
+    # as in sklearn's euclidean_distances. Rounding errors can still make the squared distance
+    # slightly negative.
+    v1, v2 = v1.astype(np.float64, copy=False), v2.astype(np.float64, copy=False)
+    sq_dist = (
+        np.einsum("ij,ij->i", v1, v1)[:, None] + np.einsum("ij,ij->i", v2, v2)[None, :] - 2 * (v1 @ v2.T)
+    )
+    d = np.sqrt(np.maximum(sq_dist, 0))
+    return (1 - d / 2).astype(dtype, copy=False)
 
 
 def custom_similarity_fn_CS_LN(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
@@ -53,13 +90,54 @@ def custom_similarity_fn_CS_ReLU(v1: np.ndarray, v2: np.ndarray) -> np.ndarray:
     return d
 
 
+_interop_threads_set: bool = False
+"""Whether the number of inter-op threads of PyTorch was already set in the current process."""
+
+
+def set_num_threads(num_threads: int) -> None:
+    """Sets the number of threads used by PyTorch and OpenCV in the current process."""
+    global _interop_threads_set
+
+    # The number of inter-op threads can only be set once per process, before any inter-op parallel
+    # work, and setting it again raises an error
+    if not _interop_threads_set:
+        if torch.get_num_interop_threads() != 1:
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                logger.warning("Could not set the number of inter-op threads, as it was already set.")
+        _interop_threads_set = True
+
+    torch.set_num_threads(num_threads)
+    cv2.setNumThreads(num_threads)
+
+
+def l2_normalize(vectors: Union[np.ndarray, torch.Tensor]) -> Union[np.ndarray, torch.Tensor]:
+    """Normalizes the vectors to unit length along the last dimension. Tensors are normalized on
+    their own device.
+    """
+    if isinstance(vectors, torch.Tensor):
+        return F.normalize(vectors, p=2, dim=-1)
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
 class RxVectorizer(ABC):
+    normalized_output: ClassVar[bool] = False
+    """Whether the model already outputs unit length vectors, in which case they are not normalized
+    again.
+    """
+    parallel_encode: ClassVar[bool] = False
+    """Whether a batch of images is encoded by a pool of threads, one image per task. This is useful for
+    the vectorizers that encode the images one by one with OpenCV and NumPy, which release the GIL.
+    """
+
     def __init__(
         self,
         model_path: Optional[Union[str, Path]] = None,
         device: Union[str, torch.device] = torch.device("cpu"),
         require_masked_input: bool = True,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
     ) -> None:
         """Initializes the RxVectorizer object.
 
@@ -72,6 +150,10 @@ class RxVectorizer(ABC):
             similarity_fn (callable):
                 Function to compare result vectors against reference each other.
                 Default to use cosine similarity.
+            num_threads (int, optional):
+                Number of threads used by PyTorch and OpenCV within the process. If None, all the
+                cores are used. Set it to 1 or 2 when running the vectorizer inside a pool of
+                processes, to avoid oversubscribing the cores.
 
         Raises:
             AssertionError: If the model path does not exist.
@@ -79,6 +161,13 @@ class RxVectorizer(ABC):
         self._device = device
         self._require_masked_input = require_masked_input
         self._similarity_fn = similarity_fn
+        self._num_threads = num_threads
+        if num_threads is not None:
+            set_num_threads(num_threads)
+
+        # Thread pool of `encode_batch`, created on the first use in the process that uses it
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
         if model_path is not None:
             # If remote model path is provided, fetch the model from the remote
             self._model_path = fetch_from_remote(model_path, cache_dir=CACHE_DIR / "vectorization")
@@ -94,39 +183,101 @@ class RxVectorizer(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def _predict(self, image: Any) -> np.ndarray:
+    def _predict(self, image: Any) -> Union[np.ndarray, torch.Tensor]:
         raise NotImplementedError
 
+    def _preprocess_batch(self, images: Sequence[np.ndarray]) -> Any:
+        """Preprocesses a batch of images. By default, each image is preprocessed independently."""
+        return [self._preprocess(image) for image in images]
+
+    def _predict_batch(self, batch: Any) -> Union[np.ndarray, torch.Tensor]:
+        """Encodes a batch of preprocessed images into a 2D array of shape (batch_size, dim). By default,
+        each image is encoded independently.
+        """
+        return np.stack([self._predict(item) for item in batch])
+
+    def _postprocess(self, vectors: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+        """Normalizes the vectors to unit length and converts them to a numpy array. The vectors are
+        only moved off the device after normalization.
+        """
+        if not self.normalized_output:
+            vectors = l2_normalize(vectors)
+        if isinstance(vectors, torch.Tensor):
+            return vectors.detach().cpu().numpy()
+        return vectors
+
     def __call__(self, image: np.ndarray) -> np.ndarray:
         """Encodes a given image using the vectorizer model."""
         image_preproc = self._preprocess(image)
         image_predict = self._predict(image_preproc)
-        return image_predict / np.linalg.norm(image_predict)
+        return self._postprocess(image_predict)
+
+    def encode_batch(
+        self, images: Union[np.ndarray, Sequence[np.ndarray]], batch_size: int = ENCODE_BATCH_SIZE
+    ) -> np.ndarray:
+        """Encodes a batch of images using the vectorizer model. The output is a 2D array of shape
+        (num_images, dim), where each row is normalized to unit length.
+
+        The images are preprocessed and encoded in chunks of at most `batch_size` images, so that the
+        memory used on the device does not grow with the number of images.
+        """
+        assert batch_size > 0, "Batch size must be positive."
+        if self.parallel_encode and len(images) > 1 and self._max_workers > 1:
+            return np.stack(list(self._get_executor().map(self, images)))
+
+        vectors = []
+        for start in range(0, len(images), batch_size):
+            image_predict = self._predict_batch(self._preprocess_batch(images[start : start + batch_size]))
+            vectors.append(self._postprocess(image_predict))
+        return np.concatenate(vectors)
 
     @overload
-    def encode(self, images: List[np.ndarray]) -> List[np.ndarray]:
+    def encode(self, images: List[np.ndarray], batch_size: int = ...) -> List[np.ndarray]:
         ...
 
     @overload
-    def encode(self, images: np.ndarray) -> np.ndarray:
+    def encode(self, images: np.ndarray, batch_size: int = ...) -> np.ndarray:
         ...
 
     @timer()
-    def encode(self, images: Union[np.ndarray, List[np.ndarray]]) -> Union[np.ndarray, List[np.ndarray]]:
+    def encode(
+        self, images: Union[np.ndarray, List[np.ndarray]], batch_size: int = ENCODE_BATCH_SIZE
+    ) -> Union[np.ndarray, List[np.ndarray]]:
         """Encodes the given image(s) using the vectorizer model. If the input is a single image,
         the output will be a 1D array. If the input is a list of images, the output will be a list
-        of 1D arrays.
+        of 1D arrays, encoded in batches of at most `batch_size` images.
         """
         if isinstance(images, np.ndarray):
             if images.ndim == 3:
                 return self(images)
             assert images.ndim == 4, "Images must be 3-dimensional (single) or 4-dimensional (stacked)."
 
-        return [self(image) for image in images]
+        if len(images) == 0:
+            return []
+
+        return list(self.encode_batch(images, batch_size=batch_size))
+
+    @property
+    def _max_workers(self) -> int:
+        """Number of threads used to encode a batch of images, capped by `num_threads` if it is set."""
+        return self._num_threads or cv2.getNumberOfCPUs()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool of the current process. It is created again in forked processes, whose
+        copy of the thread pool has no running threads.
+        """
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            self._executor_pid = os.getpid()
+        return self._executor
 
     def __getstate__(self) -> Dict[str, Any]:
-        """Return the state of the object for pickling."""
-        return self.__dict__
+        """Return the state of the object for pickling. The thread pool cannot be pickled, and is
+        created again when needed.
+        """
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        return state
 
     def __setstate__(self, state: Dict[str, Any]):
         """Restore the state of the object from pickling."""
@@ -145,12 +296,14 @@ class RxVectorizer(ABC):
 
 class RxVectorizerSift(RxVectorizer):
     num_features: ClassVar[int] = 1000
+    parallel_encode: ClassVar[bool] = True
 
     def __init__(
         self,
         model_path: Union[str, Path] = f"{SHARED_REMOTE_CKPT_DIR}/verification/vlad_1000_rn_16_v1.pkl",
         require_masked_input: bool = True,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
     ) -> None:
         """Initializes the RxVectorizerSift object.
 
@@ -164,6 +317,7 @@ class RxVectorizerSift(RxVectorizer):
             model_path=model_path,
             require_masked_input=require_masked_input,
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
 
     def _load_model(self) -> None:
@@ -193,14 +347,19 @@ class RxVectorizerSift(RxVectorizer):
         The input descriptor should be a 2D array with shape (num_features, 128).
         The output vector will be a 1D array with shape (num_clusters * 128).
         """
-        return self._model.transform([descriptor]).flatten()
+        # VLAD encodes a list of descriptor sets into a (1, num_clusters * 128) matrix, so the single
+        # row is returned as a view rather than flattened into a copy.
+        return self._model.transform([descriptor])[0]
 
 
 class RxVectorizerColorhist(RxVectorizer):
+    parallel_encode: ClassVar[bool] = True
+
     def __init__(
         self,
         require_masked_input: bool = True,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
     ) -> None:
         """
         Initializes the RxVectorizerColorhist object.
@@ -210,6 +369,7 @@ class RxVectorizerColorhist(RxVectorizer):
             model_path=None,
             require_masked_input=require_masked_input,
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
 
     def _load_model(self) -> None:
@@ -226,23 +386,25 @@ class RxVectorizerColorhist(RxVectorizer):
         # which channels do you (all RGB channels here)
         # how many descriptors do you want per channel?
         # what is the range of values per color channel?
-        hist = cv2.calcHist(
-            [image],
-            [0, 1, 2],
-            cv2.bitwise_not(cv2.inRange(image, image[0][0], image[0][0])),  # mask
-            [32, 32, 32],
-            [0, 256, 0, 256, 0, 256],
-        ).flatten()
-        final_vector = hist / np.linalg.norm(hist)
+        hist = cv2.calcHist([image], [0, 1, 2], None, [32, 32, 32], [0, 256, 0, 256, 0, 256])
 
-        return final_vector
+        # The background pixels share the color of the top left pixel, so they all fall into a single
+        # bin. Remove them from that bin rather than building a mask image of the foreground.
+        bg_color = image[0, 0]
+        hist[tuple(bg_color >> 3)] -= cv2.countNonZero(cv2.inRange(image, bg_color, bg_color))
+
+        # The vector is normalized to unit length by the caller
+        return hist.flatten()
 
 
 class RxVectorizerColorMomentHash(RxVectorizer):
+    parallel_encode: ClassVar[bool] = True
+
     def __init__(
         self,
         require_masked_input: bool = True,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_L2,
+        num_threads: Optional[int] = None,
     ) -> None:
         """
         Initializes the RxVectorizerColorhist object.
@@ -252,18 +414,40 @@ class RxVectorizerColorMomentHash(RxVectorizer):
             model_path=None,
             require_masked_input=require_masked_input,
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
+        # The hasher keeps intermediate buffers between calls, so each encoding thread gets its own
+        # instance, created once and reused for all the images encoded by that thread.
+        self._hashers = threading.local()
 
     def _load_model(self) -> None:
         pass
 
+    @property
+    def _hasher(self) -> Any:
+        """The ColorMomentHash instance of the calling thread."""
+        if not hasattr(self._hashers, "hasher"):
+            self._hashers.hasher = cv2.img_hash.ColorMomentHash_create()  # type: ignore
+        return self._hashers.hasher
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Return the state of the object for pickling, without the per-thread hashers."""
+        state = super().__getstate__()
+        state.pop("_hashers", None)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        """Restore the state of the object from pickling, with new per-thread hashers."""
+        super().__setstate__(state)
+        self._hashers = threading.local()
+
     def _preprocess(self, image: np.ndarray) -> np.ndarray:
         return image
 
     def _predict(self, image: np.ndarray) -> np.ndarray:
         """Encodes the image using the ColorMomentHash."""
 
-        hash_embedding = cv2.img_hash.ColorMomentHash_create().compute(image).flatten()  # type: ignore
+        hash_embedding = self._hasher.compute(image).flatten()
         final_vector = hash_embedding / np.linalg.norm(hash_embedding)
 
         return final_vector
@@ -274,17 +458,21 @@ class RxVectorizerDB(RxVectorizer):
         self,
         model_path: Union[str, Path],
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
     ):
         """The hidden attribures should be passed to the vectorDB object."""
         super().__init__(
             model_path=model_path,
             require_masked_input=False,  # to be overwritten by self._load_model()
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
 
     def _load_model(self) -> None:
         loaded_model = read_pickle(self._model_path)
         self._model = cast(np.ndarray, loaded_model["vectorSpace"])
+        # Transpose the vector space once so that the queries are a contiguous BLAS matrix product
+        self._model_T = np.ascontiguousarray(self._model.T, dtype=np.float32)
         self._preprocessor = loaded_model["vectorizer"]()
         self._require_masked_input = cast(RxVectorizer, self._preprocessor)._require_masked_input
 
@@ -297,11 +485,24 @@ class RxVectorizerDB(RxVectorizer):
             )
         return preprocessed_image
 
+    def _preprocess_batch(self, images: Sequence[np.ndarray]) -> np.ndarray:
+        """Encodes the images with the preprocessing vectorizer into a 2D array of shape (batch_size, dim)."""
+        return cast(RxVectorizer, self._preprocessor).encode_batch(images)
+
     def _predict(self, preproc_vector: np.ndarray) -> np.ndarray:
         assert (
-            preproc_vector.shape[0] == self._model.shape[1]
+            preproc_vector.shape[0] == self._model_T.shape[0]
         ), f"Shape mismatch - input-vector: {preproc_vector.shape}, VectorDB: {self._model.shape}."
-        return np.dot(preproc_vector, self._model.T)
+        return preproc_vector.astype(np.float32, copy=False) @ self._model_T
+
+    def _predict_batch(self, preproc_vectors: np.ndarray) -> np.ndarray:
+        """Projects a batch of vectors of shape (batch_size, dim) onto the vector space with a single
+        matrix product. The output has shape (batch_size, num_vectors).
+        """
+        assert (
+            preproc_vectors.shape[1] == self._model_T.shape[0]
+        ), f"Shape mismatch - input-vectors: {preproc_vectors.shape}, VectorDB: {self._model.shape}."
+        return preproc_vectors.astype(np.float32, copy=False) @ self._model_T
 
 
 class RxVectorizerML(RxVectorizer):
@@ -316,16 +517,24 @@ class RxVectorizerML(RxVectorizer):
         device: Union[str, torch.device] = "cpu",
         require_masked_input: bool = False,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
+        half_precision: bool = True,
+        compile_model: bool = False,
     ) -> None:
+        # Half precision is only used on CUDA devices, where it runs on the tensor cores
+        self._half_precision = half_precision
+        self._compile_model = compile_model
         super().__init__(
             model_path=model_path,
             device=device,
             require_masked_input=require_masked_input,
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
 
-        # Define the pre-processing transforms
-        self._transforms = UNIFIED_TRANSFORM
+        # ImageNet statistics on the device, scaled to the [0, 255] range of the raw images
+        self._mean = torch.tensor(IMAGENET_MEAN, device=self._device).view(1, 3, 1, 1) * 255
+        self._std = torch.tensor(IMAGENET_STD, device=self._device).view(1, 3, 1, 1) * 255
 
     def _load_model(self) -> None:
         """Loads the embedding model on the given device and sets it to eval mode."""
@@ -336,21 +545,70 @@ class RxVectorizerML(RxVectorizer):
         self._model = EmbeddingModel(**params).to(self._device)
         self._model.load_state_dict(weights)
         self._model.eval()
+
+        # Use the NHWC memory layout, which has faster convolution kernels, and half precision on CUDA
+        self._dtype = torch.float32
+        if self._half_precision and torch.device(self._device).type == "cuda":
+            self._dtype = torch.float16
+        self._model = self._model.to(dtype=self._dtype, memory_format=torch.channels_last)
+
+        if self._compile_model:
+            # Fuse the kernels and capture CUDA graphs ahead of time. The dummy forward pass triggers
+            # the compilation, so that it does not happen during the first inference.
+            self._model = torch.compile(self._model, mode="reduce-overhead", fullgraph=False)
+            self._forward(torch.zeros(1, 3, ML_INPUT_SIZE, ML_INPUT_SIZE))
         logger.info(f"Loaded Embedding model from {self._model_path} on device {self._device}.")
 
+    def _resize_and_pad(self, image: np.ndarray) -> torch.Tensor:
+        """Moves the image to the device, resizes its longest side to `ML_INPUT_SIZE` while maintaining
+        the aspect ratio and pads it with zeros on the sides to make it square. The output tensor has
+        shape (1, 3, ML_INPUT_SIZE, ML_INPUT_SIZE) and is in the [0, 255] range.
+        """
+        tensor = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1).unsqueeze(0)
+        tensor = tensor.to(self._device, non_blocking=True).float()
+
+        # Resize the longest side, maintaining the aspect ratio
+        height, width = image.shape[:2]
+        scale = ML_INPUT_SIZE / max(height, width)
+        new_height, new_width = round(height * scale), round(width * scale)
+        tensor = F.interpolate(tensor, size=(new_height, new_width), mode="bilinear", align_corners=False)
+
+        # Pad the image evenly on the sides to make it square
+        pad_top, pad_left = (ML_INPUT_SIZE - new_height) // 2, (ML_INPUT_SIZE - new_width) // 2
+        pad_bottom, pad_right = ML_INPUT_SIZE - new_height - pad_top, ML_INPUT_SIZE - new_width - pad_left
+        return F.pad(tensor, (pad_left, pad_right, pad_top, pad_bottom), value=0)
+
     def _preprocess(self, image: np.ndarray) -> torch.Tensor:
-        """Preprocesses the image for inference. This includes resizing, padding, normalization
-        and conversion to PyTorch tensor.
+        """Preprocesses the image for inference on the device. This includes resizing, padding and
+        normalization.
         """
-        return self._transforms(image=image)["image"]
+        return self._preprocess_batch([image])[0]
 
-    def _predict(self, image_tensor: torch.Tensor) -> np.ndarray:
-        """Generate the embedding vector for the given image and return it as a flatten
-        numpy array.
+    def _forward(self, batch: torch.Tensor) -> torch.Tensor:
+        """Run the model on a batch of images, in the memory layout and precision of the model. The
+        embeddings are returned in full precision.
         """
-        # Add batch dimension and move to device
-        image_tensor = image_tensor.unsqueeze(0).to(self._device)
-        return self._model(image_tensor).cpu().detach().numpy().flatten()
+        batch = batch.to(
+            self._device, dtype=self._dtype, memory_format=torch.channels_last, non_blocking=True
+        )
+        with torch.inference_mode():
+            return self._model(batch).float()
+
+    def _preprocess_batch(self, images: Sequence[np.ndarray]) -> torch.Tensor:
+        """Resizes and pads the images on the device, and normalizes the whole batch at once."""
+        batch = torch.cat([self._resize_and_pad(image) for image in images])
+        return (batch - self._mean) / self._std
+
+    def _predict(self, image_tensor: torch.Tensor) -> torch.Tensor:
+        """Generate the embedding vector for the given image and return it as a flatten tensor
+        on the device.
+        """
+        # Add batch dimension
+        return self._forward(image_tensor.unsqueeze(0)).flatten()
+
+    def _predict_batch(self, batch: torch.Tensor) -> torch.Tensor:
+        """Generate the embedding vectors for the batch of images in a single forward pass."""
+        return self._forward(batch)
 
 
 class RxVectorizerCEL(RxVectorizer):
@@ -359,6 +617,9 @@ class RxVectorizerCEL(RxVectorizer):
     normalized to unit length.
     """
 
+    # The EmbeddingLightningModel already normalizes the embeddings in its forward pass
+    normalized_output: ClassVar[bool] = True
+
     def __init__(
         self,
         model_path: Union[str, Path] = f"{SHARED_REMOTE_CKPT_DIR}/verification/resnet_18_CEL.ckpt",
@@ -366,6 +627,7 @@ class RxVectorizerCEL(RxVectorizer):
         device: Union[str, torch.device] = get_best_available_device(),
         require_masked_input: bool = False,
         similarity_fn: Callable[..., np.ndarray] = custom_similarity_fn_CS_ReLU,
+        num_threads: Optional[int] = None,
     ) -> None:
         self.arch = arch
         super().__init__(
@@ -373,6 +635,7 @@ class RxVectorizerCEL(RxVectorizer):
             device=device,
             require_masked_input=require_masked_input,
             similarity_fn=similarity_fn,
+            num_threads=num_threads,
         )
 
         # Define the pre-processing transforms
@@ -403,9 +666,17 @@ class RxVectorizerCEL(RxVectorizer):
         padded_image_tensor = self._transforms(image=image)["image"].unsqueeze(0).float().to(self._device)
         return padded_image_tensor
 
-    def _predict(self, image_tensor: torch.Tensor) -> np.ndarray:
-        """Generate the embedding vector for the given image and return it as a flatten
-        numpy array.
+    def _preprocess_batch(self, images: Sequence[np.ndarray]) -> torch.Tensor:
+        """Preprocesses the images and concatenates them into a single batch tensor."""
+        return torch.cat([self._preprocess(image) for image in images])
+
+    def _predict(self, image_tensor: torch.Tensor) -> torch.Tensor:
+        """Generate the embedding vector for the given image and return it as a flatten tensor
+        on the device.
         """
-        prediction = self._model(image_tensor).cpu().detach().numpy().flatten()  # type: ignore
-        return prediction
+        return self._model(image_tensor).flatten()  # type: ignore
+
+    def _predict_batch(self, batch: torch.Tensor) -> torch.Tensor:
+        """Generate the embedding vectors for the batch of images in a single forward pass."""
+        with torch.inference_mode():
+            return self._model(batch)  # type: ignore
@@ -2,10 +2,11 @@ from enum import Enum
 from pathlib import Path
 from typing import ClassVar, Dict, Optional, Tuple, Union
 
+import numpy as np
 import torch
-from skimage.io import imread
 from torch.utils.data import Dataset
 
+from rx_connect.core.images.io import read_grayscale_image, read_rgb_image
 from rx_connect.core.images.types import img_to_tensor
 from rx_connect.core.utils.io_utils import (
     filter_matching_pairs,
@@ -108,12 +109,13 @@ class SegDataset(Dataset):
 
     def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
         # Read input image and ground truth mask
-        image = imread(self.image_paths[idx])
-        mask = imread(self.mask_paths[idx])
+        image = read_rgb_image(self.image_paths[idx])
+        mask = read_grayscale_image(self.mask_paths[idx])
 
         # The dataset contains different pixel values for the different pills,
-        # and hence we need to convert them to binary masks
-        mask[mask > 0] = 1
+        # and hence we need to convert them to binary masks. The mask is uint8, so clipping it to 1
+        # in place binarizes it in a single pass.
+        np.minimum(mask, 1, out=mask)
 
         # Apply augmentations
         if self.transforms is not None:
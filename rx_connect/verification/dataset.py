@@ -1,5 +1,6 @@
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Optional, Union
+from typing import Any, Dict, Optional, Tuple, Union
 
 import lightning as L
 import numpy as np
@@ -7,10 +8,10 @@ import pandas as pd
 import torch
 from albumentations.pytorch.transforms import ToTensorV2
 from lightning.pytorch.utilities.types import EVAL_DATALOADERS, TRAIN_DATALOADERS
-from skimage import io
 from sklearn.preprocessing import LabelEncoder
 from torch.utils.data import DataLoader, Dataset
 
+from rx_connect.core.images.io import read_rgb_image
 from rx_connect.core.types.verification.dataset import ePillIDDataset
 from rx_connect.tools.logging import setup_logger
 from rx_connect.tools.serialization import read_pickle, write_pickle
@@ -19,6 +20,26 @@ from rx_connect.verification.augments import RefConsTransform
 logger = setup_logger()
 
 
+@lru_cache(maxsize=32)
+def load_cached_image(image_path: Path) -> np.ndarray:
+    """Load an image and cache it. With rotation augmentation, the rotations of an image are consecutive
+    samples of the dataset, so the image is only decoded once for all of its rotations. The image is
+    read-only, as it is shared between the samples.
+    """
+    image = read_rgb_image(image_path)
+    image.setflags(write=False)
+    return image
+
+
+@lru_cache(maxsize=1024)
+def load_ref_tensor(image_path: Path) -> torch.Tensor:
+    """Load a reference image as a tensor. The reference images are shared by all the consumer images
+    of the same pill type, so the decoded tensors are cached.
+    """
+    ref_image = read_rgb_image(image_path)
+    return ToTensorV2()(image=ref_image)["image"]
+
+
 class SingleImagePillID(Dataset):
     """A PyTorch Dataset subclass, SingleImagePillID, dedicated to efficiently loading
     and preprocessing data for machine learning models, specifically designed for pill
@@ -44,6 +65,8 @@ class SingleImagePillID(Dataset):
     Methods:
         rotate_df(df: pd.DataFrame, n_rotations: int = 24) -> pd.DataFrame:
             Enhances the original DataFrame by creating various rotation states of each image.
+        build_ref_index(df: pd.DataFrame) -> Dict[Tuple[str, bool], int]:
+            Maps each pill type and side to the position of its reference image in the DataFrame.
         load_img(df_row: pd.Series) -> torch.Tensor:
             Loads an image given a DataFrame row, applying the prescribed transformations.
         __len__() -> int:
@@ -70,6 +93,26 @@ class SingleImagePillID(Dataset):
         self.transforms = transforms
         self.df = self.rotate_df(df, 360 // self.rotate_aug) if self.rotate_aug is not None else df
         self.return_ref = return_ref
+        self._ref_index = self.build_ref_index(self.df)
+
+        # Encode the labels of all the images once, rather than calling the label encoder per sample.
+        # Pill types unknown to the label encoder are marked with -1.
+        label_map = {pilltype_id: label for label, pilltype_id in enumerate(self.label_encoder.classes_)}
+        self._labels = self.df.pilltype_id.map(label_map).fillna(-1).to_numpy(np.int64)
+
+    @staticmethod
+    def build_ref_index(df: pd.DataFrame) -> Dict[Tuple[str, bool], int]:
+        """Map each (pilltype_id, is_front) pair to the position of its first reference image in the
+        DataFrame, so that reference images can be looked up without scanning the DataFrame.
+        """
+        ref_positions = np.flatnonzero(df.is_ref.to_numpy())
+        ref_keys = zip(df.pilltype_id.iloc[ref_positions], df.is_front.iloc[ref_positions])
+
+        ref_index: Dict[Tuple[str, bool], int] = {}
+        for position, (pilltype_id, is_front) in zip(ref_positions, ref_keys):
+            ref_index.setdefault((pilltype_id, bool(is_front)), int(position))
+
+        return ref_index
 
     def rotate_df(self, df: pd.DataFrame, n_rotations: int = 24) -> pd.DataFrame:
         """Generate a new DataFrame that represents various rotation states of the original data.
@@ -98,19 +141,19 @@ class SingleImagePillID(Dataset):
     def load_ref_image(self, df_row: pd.Series) -> torch.Tensor:
         """Returns a reference image of the given image matching with front/back side
         of the image; filtered out by Pill Type"""
-        new_row = self.df[
-            (self.df.pilltype_id == df_row.pilltype_id)
-            & (self.df.is_ref)
-            & (self.df.is_front == df_row.is_front)
-        ].iloc[0]
-        ref_image: np.ndarray = io.imread(self.root / new_row.image_path)
+        new_row = self.df.iloc[self._ref_index[(df_row.pilltype_id, bool(df_row.is_front))]]
 
-        return ToTensorV2()(image=ref_image)["image"]
+        return load_ref_tensor(self.root / new_row.image_path)
 
     def load_img(self, df_row: pd.Series) -> torch.Tensor:
         """Load image and apply transforms"""
         img_path, is_ref = df_row.image_path, df_row.is_ref
-        image: np.ndarray = io.imread(self.root / img_path)
+        # The rotation always returns a new array, so the cached image is never modified
+        image = (
+            load_cached_image(self.root / img_path)
+            if self.rotate_aug is not None
+            else read_rgb_image(self.root / img_path)
+        )
         rot_degree: int = df_row.rot_degree if self.rotate_aug is not None else 0
 
         return self.transforms(image, is_ref=is_ref, rot_degree=rot_degree)
@@ -123,13 +166,16 @@ class SingleImagePillID(Dataset):
 
         # Load image and apply transforms
         image: torch.Tensor = self.load_img(df_row)
-        ref_image: torch.Tensor = self.load_ref_image(df_row)
-        ndc_code: str = df_row.pilltype_id
+        ref_image: Optional[torch.Tensor] = self.load_ref_image(df_row) if self.return_ref else None
+
+        label = int(self._labels[idx])
+        if label < 0:
+            raise ValueError(f"The label encoder has not seen the pill type: {df_row.pilltype_id}")
 
         return {
             "image": image,
-            "ref_image": ref_image if self.return_ref else None,
-            "label": int(self.label_encoder.transform([ndc_code])[0]),
+            "ref_image": ref_image,
+            "label": label,
             "image_name": str(df_row.image_path),
             "is_ref": bool(df_row.is_ref),
             "is_front": bool(df_row.is_front),
@@ -146,6 +192,7 @@ class PillIDDataModule(L.LightningDataModule):
         num_workers: int = 8,
         pin_memory: bool = True,
         return_ref: bool = False,
+        prefetch_factor: int = 4,
         **kwargs: Any,
     ) -> None:
         super().__init__()
@@ -155,6 +202,11 @@ class PillIDDataModule(L.LightningDataModule):
         self.batch_size = batch_size
         self.num_workers = num_workers
         self.pin_memory = pin_memory
+
+        # Keep the workers alive across epochs and their prefetch queues full. Both options are only
+        # valid when loading with worker processes.
+        self.persistent_workers = num_workers > 0
+        self.prefetch_factor = prefetch_factor if num_workers > 0 else None
         self.return_ref = return_ref
         self.kwargs = kwargs
 
@@ -165,18 +217,23 @@ class PillIDDataModule(L.LightningDataModule):
         self.init_dataframes()
 
     def init_dataframes(self) -> None:
-        train_df = self.df[self.df.split == "train"]
-        val_df = self.df[self.df.split == "val"]
+        # Compute the boolean masks of the splits and of the reference images once, as plain arrays
+        split = self.df.split.astype("category")
+        is_train = (split == "train").to_numpy()
+        is_val = (split == "val").to_numpy()
+        is_ref = self.df.is_ref.to_numpy(dtype=bool)
 
-        ref_only_df, cons_train_df = train_df[train_df.is_ref], train_df[~train_df.is_ref]
-        cons_val_df = val_df[~val_df.is_ref]
+        ref_only_df, cons_train_df = self.df[is_train & is_ref], self.df[is_train & ~is_ref]
+        cons_val_df = self.df[is_val & ~is_ref]
 
         self.train_df = pd.concat([ref_only_df, cons_train_df], sort=False)
         self.val_df = pd.concat([ref_only_df, cons_val_df])
 
-        labels_df = pd.DataFrame({"pilltype_id": self.label_encoder.classes_})
-        self.eval_df = pd.merge(cons_val_df, labels_df, on=["pilltype_id"], how="inner")
-        self.ref_df = pd.merge(ref_only_df, labels_df, on=["pilltype_id"], how="inner")
+        # Keep only the pill types known to the label encoder. This is the inner join on `pilltype_id`
+        # with the encoder classes, without building a hash join for it.
+        known_labels = self.label_encoder.classes_
+        self.eval_df = cons_val_df[cons_val_df.pilltype_id.isin(known_labels)].reset_index(drop=True)
+        self.ref_df = ref_only_df[ref_only_df.pilltype_id.isin(known_labels)].reset_index(drop=True)
 
     def setup(self, stage: Optional[str] = None) -> None:
         if stage == "fit" or stage is None:
@@ -222,6 +279,8 @@ class PillIDDataModule(L.LightningDataModule):
             shuffle=True,
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers,
+            prefetch_factor=self.prefetch_factor,
             drop_last=True,
         )
 
@@ -232,6 +291,8 @@ class PillIDDataModule(L.LightningDataModule):
             shuffle=False,
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers,
+            prefetch_factor=self.prefetch_factor,
             drop_last=False,
         )
 
@@ -244,6 +305,8 @@ class PillIDDataModule(L.LightningDataModule):
             shuffle=False,
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers,
+            prefetch_factor=self.prefetch_factor,
             drop_last=False,
         )
         ref_dl = DataLoader(
@@ -252,6 +315,8 @@ class PillIDDataModule(L.LightningDataModule):
             shuffle=False,
             num_workers=self.num_workers,
             pin_memory=self.pin_memory,
+            persistent_workers=self.persistent_workers,
+            prefetch_factor=self.prefetch_factor,
             drop_last=False,
         )
         return [test_dl, ref_dl]
@@ -1,7 +1,4 @@
-from typing import List
-
 import lightning as L
-import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -28,10 +25,15 @@ class EmbeddingLightningModel(L.LightningModule):
         super().__init__()
 
         self.model = model
-        self.similar_fn = F.cosine_similarity
         self.relu = nn.ReLU()
         self.criterion = nn.MSELoss()
-        self.epoch_margin: List[float] = []
+        # Running sum and count of the margins over the epoch
+        self._margin_sum: float = 0.0
+        self._margin_count: int = 0
+
+        # Targets of the margin loss, registered as buffers so that they are moved with the model
+        self.register_buffer("_one", torch.tensor([1.0]), persistent=False)
+        self.register_buffer("_zero", torch.tensor([0.0]), persistent=False)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         """
@@ -54,36 +56,38 @@ class EmbeddingLightningModel(L.LightningModule):
 
         sample_0 = torch.cat([query_vec[:ref0_count], ref_vec[0].unsqueeze(0)])
         sample_1 = torch.cat([query_vec[ref0_count:], ref_vec[1].unsqueeze(0)])
-        pos0 = self.similar_fn(sample_0.unsqueeze(1), sample_0.unsqueeze(0), dim=2)
-        pos1 = self.similar_fn(sample_1.unsqueeze(1), sample_1.unsqueeze(0), dim=2)
-        A2A_neg = self.similar_fn(sample_0.unsqueeze(1), sample_1.unsqueeze(0), dim=2)
-        cluster_pos = torch.min(torch.cat([pos0.view(-1), pos1.view(-1)])).unsqueeze(0) / 2 + 0.5  # type: ignore
-        cluster_neg = torch.max(A2A_neg).unsqueeze(0) / 2 + 0.5
+
+        # The embeddings are unit length, so their pairwise cosine similarities are plain matrix products
+        pos0 = sample_0 @ sample_0.T
+        pos1 = sample_1 @ sample_1.T
+        A2A_neg = sample_0 @ sample_1.T
+        cluster_pos = torch.minimum(pos0.amin(), pos1.amin()).unsqueeze(0) / 2 + 0.5
+        cluster_neg = A2A_neg.amax().unsqueeze(0) / 2 + 0.5
 
         assert hasattr(self.logger, "log_metrics")
         margin = cluster_pos - cluster_neg
-        margin_loss = self.criterion(cluster_pos, torch.Tensor([1]).to(self.device)) + self.criterion(
-            cluster_neg, torch.Tensor([0]).to(self.device)
-        )
+        margin_loss = self.criterion(cluster_pos, self._one) + self.criterion(cluster_neg, self._zero)
 
+        margin_value = margin.item()
         self.log_dict(
             {
                 "cluster_pos": cluster_pos.item(),
                 "cluster_neg": cluster_neg.item(),
-                "margin": margin.item(),
+                "margin": margin_value,
                 "margin_loss": margin_loss.item(),
             }
         )
-        self.epoch_margin.append(margin.item())
+        self._margin_sum += margin_value
+        self._margin_count += 1
         return margin_loss
 
     def on_train_epoch_end(self) -> None:
         """
         Log epoch average margin.
         """
-        epoch_avg_margin = np.mean(self.epoch_margin)
-        self.epoch_margin.clear()
-        self.log("epoch_avg_margin", float(epoch_avg_margin))
+        epoch_avg_margin = self._margin_sum / max(self._margin_count, 1)
+        self._margin_sum, self._margin_count = 0.0, 0
+        self.log("epoch_avg_margin", epoch_avg_margin)
 
     def train_dataloader(self) -> TRAIN_DATALOADERS:
         return ContinuousLearningDataLoader(mode="train")
@@ -1,9 +1,12 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import roc_curve
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
 
 
 class BinaryClassificationEvaluator:
@@ -38,9 +41,24 @@ class BinaryClassificationEvaluator:
         self.pos_predicted = pos_predicted
         self.neg_predicted = neg_predicted
         self.model = model
+
+        # Arrays of the positive and negative similarity scores, used to binarize them at any threshold
+        self._pos = np.asarray(pos_predicted, dtype=np.float32)
+        self._neg = np.asarray(neg_predicted, dtype=np.float32)
+        self._n_pos = self._pos.size
+
+        # The true and false positives at every unique score are counted once, in the sorted scores, and
+        # shared by the ROC curve and the F-beta threshold sweep
+        self._pos_sorted, self._neg_sorted = np.sort(self._pos), np.sort(self._neg)
+        self._thresholds, self._true_pos_counts, self._false_pos_counts = count_positives(
+            self._pos_sorted, self._neg_sorted
+        )
         self.fpr, self.tpr, self.opt_threshold, self.ix = self._youden()
 
-    def _youden(self) -> Tuple[List[float], List[float], float, int]:
+        # Figure of the ROC curve, reused across the calls to plots()
+        self._fig_ax: Optional[Tuple[Figure, Axes]] = None
+
+    def _youden(self) -> Tuple[np.ndarray, np.ndarray, float, int]:
         """
         Youden's J statistic: https://en.wikipedia.org/wiki/Youden%27s_J_statistic
         Find the optimal probability cutoff point for a classification model based on the Youden's J statistic.
@@ -52,12 +70,17 @@ class BinaryClassificationEvaluator:
         #  or J = TPR + (1 – FPR) – 1
         #  or J = sqrt(tpr*(1-fpr))
 
-        fpr, tpr, threshold = roc_curve(self.target, self.predicted)
-        J = tpr - fpr
+        tpr = self._true_pos_counts / self._n_pos
+        fpr = self._false_pos_counts / self._neg_sorted.size
+        threshold = self._thresholds
+
+        # J scaled by n_pos * n_neg is compared in integers, so that ties between thresholds are exact
+        # and always resolve to the first (highest) threshold
+        J = self._true_pos_counts * self._neg_sorted.size - self._false_pos_counts * self._n_pos
         ix = np.argmax(J)
         opt_threshold = threshold[ix]
 
-        return list(fpr), list(tpr), float(opt_threshold), int(ix)
+        return fpr, tpr, float(opt_threshold), int(ix)
 
     def F_score_metrics(
         self, thresh: Optional[float] = None, beta: float = 1.0
@@ -71,26 +94,37 @@ class BinaryClassificationEvaluator:
 
         thresh = thresh or self.opt_threshold
 
-        # binarizing the similarity scores saved in true_pos and false_pos using t
-        self.true_pos = sum(x > thresh for x in self.pos_predicted)
-        self.false_pos = sum(x > thresh for x in self.neg_predicted)
+        # binarizing the similarity scores saved in true_pos and false_pos using t. The scores above t
+        # are counted with a binary search in the sorted float32 scores.
+        thresh_f32 = np.float32(thresh)
+        self.true_pos = self._n_pos - int(np.searchsorted(self._pos_sorted, thresh_f32, side="right"))
+        self.false_pos = self._neg_sorted.size - int(
+            np.searchsorted(self._neg_sorted, thresh_f32, side="right")
+        )
 
-        n_pos = len(self.pos_predicted)
-        precision = self.true_pos / (self.true_pos + self.false_pos + 1e-5)
-        recall = self.true_pos / n_pos
+        precision = _divide(self.true_pos, self.true_pos + self.false_pos)
+        recall = _divide(self.true_pos, self._n_pos)
 
         # The Fβ_score score is useful when we want to prioritize
         # one measure while preserving results from the other measure.
 
-        F_score = (1 + beta**2) * (precision * recall) / ((beta**2 * precision) + recall + 1e-5)
+        F_score = _divide((1 + beta**2) * (precision * recall), (beta**2 * precision) + recall)
         return precision, recall, F_score, thresh
 
     def binary_metrics(self) -> Tuple[float, float, float, Union[float, None]]:
-        return self.F_score_metrics()
+        """Precision, recall and F1-score at the optimal threshold of the Youden's J statistic. They are
+        read from the counts at the optimal point of the ROC curve, where the scores greater than or equal
+        to the threshold are positive, instead of binarizing the scores again.
+        """
+        true_pos = int(self._true_pos_counts[self.ix])
+        false_pos = int(self._false_pos_counts[self.ix])
 
-    def custome_binary_metrics(self, beta) -> Tuple[float, float, float, float]:
-        thresholds = np.arange(0, 1, 0.001)
+        precision = _divide(true_pos, true_pos + false_pos)
+        recall = _divide(true_pos, self._n_pos)
+        F_score = _divide(2 * (precision * recall), precision + recall)
+        return precision, recall, F_score, self.opt_threshold
 
+    def custome_binary_metrics(self, beta) -> Tuple[float, float, float, float]:
         # f1-score is defined where β is 1. A β value less than 1
         # favors the precision metric, while values greater than 1
         # favor the recall metric. beta = 0.5 and 2 are the most
@@ -98,18 +132,7 @@ class BinaryClassificationEvaluator:
         # ref: https://en.wikipedia.org/wiki/F-score
 
         beta = 0.5
-        precision_beta, recall_beta, f_beta_scores = [], [], []
-
-        for thresh in thresholds:
-            p, r, f, _ = self.F_score_metrics(thresh, beta)
-
-            precision_beta.append(p)
-            recall_beta.append(r)
-            f_beta_scores.append(f)
-
-        # get optimal threshold
-        ix = np.argmax(f_beta_scores)
-        return precision_beta[ix], recall_beta[ix], f_beta_scores[ix], thresholds[ix]
+        return f_beta_sweep(self._thresholds, self._true_pos_counts, self._false_pos_counts, beta)
 
     def prob_metrics(
         self,
@@ -134,28 +157,153 @@ class BinaryClassificationEvaluator:
                 - prob_diff_positive: The overall positive error probability.
                 - prob_diff_negative: The overall negative error probability.
         """
-        sum_p, sum_pcount = 0.0, 0
-        for mean_p, count_pills in prob_diff_pos_dict.values():
-            sum_p += mean_p * count_pills
-            sum_pcount += count_pills
-        prob_diff_positive = sum_p / sum_pcount
-
-        sum_n, sum_ncount = 0.0, 0
-        for mean_n, count_pills in prob_diff_neg_dict.values():
-            sum_n += mean_n * count_pills
-            sum_ncount += count_pills
-        prob_diff_negative = sum_n / sum_ncount
+        prob_diff_positive = self._weighted_mean(prob_diff_pos_dict)
+        prob_diff_negative = self._weighted_mean(prob_diff_neg_dict)
 
         return prob_diff_positive, prob_diff_negative
 
+    @staticmethod
+    def _weighted_mean(prob_diff_dict: Dict[str, Tuple[float, int]]) -> float:
+        """Mean of the error probabilities in the dictionary, weighted by their count of pills."""
+        values = np.fromiter(
+            (value for pair in prob_diff_dict.values() for value in pair),
+            dtype=np.float64,
+            count=2 * len(prob_diff_dict),
+        ).reshape(-1, 2)
+        return float(np.dot(values[:, 0], values[:, 1]) / values[:, 1].sum())
+
     def plots(self) -> None:
-        fig, ax = plt.subplots()
+        # The figure is created on the first call and cleared on the next ones
+        if self._fig_ax is None:
+            self._fig_ax = plt.subplots()
+        fig, ax = self._fig_ax
+        ax.clear()
+
         ax.plot([0, 1], [0, 1], linestyle="--", label="1:1")
         ax.plot(self.fpr, self.tpr, linewidth=1.5)
         ax.plot(self.fpr[self.ix], self.tpr[self.ix], "bo", ms=15)
-        plt.xlabel("False Positive Rate (FPR)")
-        plt.ylabel("True Positive Rate (TPR)")
-        plt.title(f"ROC Curve for {self.model} ({self.threshold_label}={self.opt_threshold:.2f})")
+        ax.set_xlabel("False Positive Rate (FPR)")
+        ax.set_ylabel("True Positive Rate (TPR)")
+        ax.set_title(f"ROC Curve for {self.model} ({self.threshold_label}={self.opt_threshold:.2f})")
         self.plot_path.mkdir(parents=True, exist_ok=True)
         plot_filename = self.plot_path / f"{self.model}.png"
         fig.savefig(plot_filename)
+
+        # Release the figure from pyplot, which otherwise keeps every figure open until the process exits
+        plt.close(fig)
+
+
+def _divide(numerator: float, denominator: float) -> float:
+    """Divide the numerator by the denominator, or return 0 when the denominator is 0. This is used for
+    the precision, recall and F-scores, which are 0 when there is nothing to count.
+    """
+    return float(numerator / denominator) if denominator > 0 else 0.0
+
+
+def count_positives(
+    pos_sorted: np.ndarray, neg_sorted: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count the true and false positives when the scores greater than or equal to the threshold are
+    positive, for every unique score in decreasing order. As in sklearn's roc_curve, the first threshold
+    is above all the scores, so that no score is positive.
+
+    Args:
+        pos_sorted: The sorted similarity scores compared against the true references.
+        neg_sorted: The sorted similarity scores compared against the false references.
+
+    Returns:
+        Tuple(thresholds, true_pos, false_pos)
+    """
+    thresholds = np.unique(np.concatenate([pos_sorted, neg_sorted]))[::-1]
+    true_pos = pos_sorted.size - np.searchsorted(pos_sorted, thresholds, side="left")
+    false_pos = neg_sorted.size - np.searchsorted(neg_sorted, thresholds, side="left")
+
+    thresholds = np.concatenate([[thresholds[0] + 1], thresholds])
+    return thresholds, np.concatenate([[0], true_pos]), np.concatenate([[0], false_pos])
+
+
+def f_beta_sweep(
+    thresholds: np.ndarray, true_pos: np.ndarray, false_pos: np.ndarray, beta: float
+) -> Tuple[float, float, float, float]:
+    """Find the threshold that maximizes the F-beta score, from the counts of `count_positives`.
+
+    The returned threshold follows the convention of `BinaryClassificationEvaluator.F_score_metrics`,
+    where the scores strictly greater than the threshold are positive.
+
+    Returns:
+        Tuple(precision, recall, F_beta_score, Opt_threshold)
+    """
+    # The binarized scores only change when the threshold crosses one of the scores, so the unique
+    # scores are the smallest set of thresholds that visits every possible F-beta score. The scores
+    # greater than or equal to one score are the ones greater than the next lower score, so the counts
+    # of the ROC curve are reused, in increasing order of the thresholds. The value just below the
+    # lowest score is the threshold for the case where all the scores are positive.
+    n_pos = int(true_pos[-1])
+    gt_thresholds = np.concatenate([thresholds[1:], [np.nextafter(thresholds[-1], -np.inf)]])
+
+    # Lowering the threshold past scores that are all negative only adds false positives, which lowers
+    # the F-beta score. The maximum is therefore at one of the thresholds where the true positives
+    # increase, and only these candidates are evaluated.
+    candidates = np.flatnonzero(np.diff(true_pos, prepend=-1))[::-1]
+    gt_thresholds, true_pos, false_pos = (
+        gt_thresholds[candidates],
+        true_pos[candidates],
+        false_pos[candidates],
+    )
+
+    # With precision = TP / (TP + FP) and recall = TP / n_pos, the F-beta score simplifies to
+    # (1 + β²) * TP / (β² * n_pos + TP + FP), which is computed in place in a single float32 buffer
+    # without the intermediate precision and recall arrays.
+    f_beta_scores = np.empty(gt_thresholds.size, dtype=np.float32)
+    np.add(true_pos, false_pos, out=f_beta_scores)
+    f_beta_scores += beta**2 * n_pos
+    # The denominator is only zero when there are no positive scores at all, where the F-beta score is 0
+    np.divide(true_pos, f_beta_scores, out=f_beta_scores, where=f_beta_scores > 0)
+    f_beta_scores *= 1 + beta**2
+
+    # get optimal threshold
+    ix = np.argmax(f_beta_scores)
+    precision_beta = _divide(true_pos[ix], true_pos[ix] + false_pos[ix])
+    recall_beta = _divide(true_pos[ix], n_pos)
+    return float(precision_beta), float(recall_beta), float(f_beta_scores[ix]), float(gt_thresholds[ix])
+
+
+def optimal_f_beta_threshold(
+    pos_predicted: Sequence[float], neg_predicted: Sequence[float], beta: float
+) -> Tuple[float, float, float, float]:
+    """Find the threshold that maximizes the F-beta score of a model, from its positive and negative
+    similarity scores. This is the computation of `BinaryClassificationEvaluator.custome_binary_metrics`
+    as a free function, so that it can be dispatched to worker processes.
+
+    Returns:
+        Tuple(precision, recall, F_beta_score, Opt_threshold)
+    """
+    pos_sorted = np.sort(np.asarray(pos_predicted, dtype=np.float32))
+    neg_sorted = np.sort(np.asarray(neg_predicted, dtype=np.float32))
+    return f_beta_sweep(*count_positives(pos_sorted, neg_sorted), beta)
+
+
+def optimal_f_beta_thresholds(
+    pos_predicted: Sequence[Sequence[float]],
+    neg_predicted: Sequence[Sequence[float]],
+    beta: float,
+    max_workers: Optional[int] = None,
+) -> List[Tuple[float, float, float, float]]:
+    """Find the F-beta optimal thresholds of several models in parallel, one model per worker process.
+
+    Args:
+        pos_predicted: The positive similarity scores of each model.
+        neg_predicted: The negative similarity scores of each model.
+        beta: The beta of the F-beta score.
+        max_workers: The maximum number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        List of Tuple(precision, recall, F_beta_score, Opt_threshold), in the order of the models.
+    """
+    assert len(pos_predicted) == len(neg_predicted), "Number of positive and negative score sets must match."
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                optimal_f_beta_threshold, pos_predicted, neg_predicted, repeat(beta, len(pos_predicted))
+            )
+        )
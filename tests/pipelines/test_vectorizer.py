@@ -0,0 +1,32 @@
+import pickle
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+if not hasattr(cv2, "img_hash"):
+    pytest.skip("ColorMomentHash requires the opencv-contrib-python package.", allow_module_level=True)
+
+from rx_connect.pipelines.vectorizer import RxVectorizerColorMomentHash  # noqa: E402
+
+
+@pytest.fixture
+def image() -> np.ndarray:
+    return np.random.default_rng(0).integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+
+
+def test_color_moment_hash_encode(image: np.ndarray) -> None:
+    vectorizer = RxVectorizerColorMomentHash()
+    vector = vectorizer.encode(image)
+
+    assert vector.ndim == 1
+    assert np.isclose(np.linalg.norm(vector), 1.0)
+
+
+def test_color_moment_hash_pickle(image: np.ndarray) -> None:
+    vectorizer = RxVectorizerColorMomentHash()
+    expected = vectorizer.encode(image)
+
+    restored = pickle.loads(pickle.dumps(vectorizer))
+    np.testing.assert_allclose(restored.encode(image), expected)
+    np.testing.assert_allclose(restored.encode([image, image]), [expected, expected])